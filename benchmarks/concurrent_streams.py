@@ -0,0 +1,110 @@
+"""
+Load test: N streams de stream_completion en paralelo.
+
+Usa un transporte httpx en memoria que imita el SSE de chat completions de
+OpenAI, asi que no hace falta API key. Si las streams se intercalan y el
+heartbeat del event loop no se retrasa, stream_completion no bloquea.
+
+    python -m benchmarks.concurrent_streams --streams 20 --tokens 50 --delay 0.02
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import httpx
+from openai import AsyncOpenAI
+
+# Los clientes se crean al importar y exigen una clave, aunque aca nunca
+# se use
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+
+from server.utils import openai_functions
+
+
+def fake_openai_transport(tokens: int, delay: float) -> httpx.MockTransport:
+    async def sse_body(model: str):
+        for i in range(tokens):
+            await asyncio.sleep(delay)
+            chunk = {
+                "id": "chatcmpl-bench",
+                "object": "chat.completion.chunk",
+                "created": 0,
+                "model": model,
+                "choices": [
+                    {"index": 0, "delta": {"content": f"tok{i} "}, "finish_reason": None}
+                ],
+            }
+            yield f"data: {json.dumps(chunk)}\n\n".encode()
+        yield b"data: [DONE]\n\n"
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        model = json.loads(request.content).get("model", "gpt-4o-mini")
+        return httpx.Response(
+            200,
+            headers={"content-type": "text/event-stream"},
+            content=sse_body(model),
+        )
+
+    return httpx.MockTransport(handler)
+
+
+async def heartbeat(interval: float, lags: list, stop: asyncio.Event):
+    while not stop.is_set():
+        expected = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - expected)
+
+
+async def run_stream(stream_id: int, timeline: list):
+    first_token = None
+    start = time.perf_counter()
+    async for _ in openai_functions.stream_completion("bench", "hola"):
+        now = time.perf_counter()
+        if first_token is None:
+            first_token = now - start
+        timeline.append((now, stream_id))
+    return first_token, time.perf_counter() - start
+
+
+async def main(streams: int, tokens: int, delay: float):
+    openai_functions.async_client = AsyncOpenAI(
+        api_key="bench",
+        http_client=httpx.AsyncClient(transport=fake_openai_transport(tokens, delay)),
+    )
+
+    timeline = []
+    lags = []
+    stop = asyncio.Event()
+    beat = asyncio.create_task(heartbeat(0.01, lags, stop))
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(run_stream(i, timeline) for i in range(streams)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await beat
+
+    timeline.sort()
+    switches = sum(1 for a, b in zip(timeline, timeline[1:]) if a[1] != b[1])
+    serial_time = streams * tokens * delay
+
+    print(f"streams={streams} tokens/stream={tokens} delay={delay}s")
+    print(f"wall time: {elapsed:.2f}s (serial would be ~{serial_time:.2f}s)")
+    print(f"stream switches in token timeline: {switches} of {len(timeline) - 1}")
+    print(f"max TTFT: {max(r[0] for r in results) * 1000:.1f}ms")
+    print(f"max event loop lag: {max(lags, default=0) * 1000:.1f}ms")
+
+    interleaved = elapsed < serial_time / 2 and switches > streams
+    print("OK: streams interleave" if interleaved else "FAIL: streams ran serially")
+    return 0 if interleaved else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--streams", type=int, default=20)
+    parser.add_argument("--tokens", type=int, default=50)
+    parser.add_argument("--delay", type=float, default=0.02)
+    args = parser.parse_args()
+    raise SystemExit(asyncio.run(main(args.streams, args.tokens, args.delay)))
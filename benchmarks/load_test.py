@@ -0,0 +1,419 @@
+"""
+Load test de punta a punta contra el servidor real y un mock de OpenAI/Ollama.
+
+Levanta benchmarks.mock_server y main.py como subprocesos (o usa --app-url
+si la app ya esta corriendo apuntada al mock), crea un usuario y corre:
+
+  socket: N sesiones socket.io concurrentes enviando "message" y midiendo
+          TTFT (primer "response") y duracion hasta "responseFinished"
+  rest:   N clientes concurrentes contra /get_completion/, /conversations,
+          /get-models, /generate_speech/ y /upload-audio/
+
+Reporta p50/p99 de TTFT y latencia, throughput y memoria del proceso de la
+app. Con --json el reporte sale en JSON para comparar entre commits.
+
+    python -m benchmarks.load_test --scenario all --sessions 50 --messages 3
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import aiohttp
+import httpx
+import socketio
+
+from benchmarks.mock_server import add_mock_arguments
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def summarize(samples, elapsed):
+    """samples: lista de dicts con ok, latency y opcionalmente ttft y chunks."""
+    ok = [s for s in samples if s["ok"]]
+    ttfts = [s["ttft"] for s in ok if s.get("ttft") is not None]
+    latencies = [s["latency"] for s in ok]
+    chunks = sum(s.get("chunks", 0) for s in ok)
+    summary = {
+        "requests": len(samples),
+        "errors": len(samples) - len(ok),
+        "throughput_rps": len(ok) / elapsed if elapsed else 0.0,
+        "latency_p50_ms": percentile(latencies, 50) * 1000,
+        "latency_p99_ms": percentile(latencies, 99) * 1000,
+    }
+    if ttfts:
+        summary["ttft_p50_ms"] = percentile(ttfts, 50) * 1000
+        summary["ttft_p99_ms"] = percentile(ttfts, 99) * 1000
+    if chunks:
+        summary["chunks_per_second"] = chunks / elapsed
+    return summary
+
+
+def process_memory(pid):
+    """RSS actual y pico (kB) del proceso y sus hijos (workers). Solo Linux."""
+    pids = [pid]
+    try:
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat") as file:
+                    if int(file.read().rsplit(")", 1)[1].split()[1]) == pid:
+                        pids.append(int(entry))
+            except (OSError, ValueError, IndexError):
+                continue
+    except OSError:
+        return None
+
+    rss = peak = 0
+    for child in pids:
+        try:
+            with open(f"/proc/{child}/status") as file:
+                for line in file:
+                    if line.startswith("VmRSS:"):
+                        rss += int(line.split()[1])
+                    elif line.startswith("VmHWM:"):
+                        peak += int(line.split()[1])
+        except OSError:
+            continue
+    return {"rss_kb": rss, "peak_rss_kb": peak}
+
+
+def mock_command(args):
+    return [
+        sys.executable,
+        "-m",
+        "benchmarks.mock_server",
+        "--port",
+        str(args.mock_port),
+        "--ttft",
+        str(args.ttft),
+        "--token-rate",
+        str(args.token_rate),
+        "--tokens",
+        str(args.tokens),
+        "--transcription-latency",
+        str(args.transcription_latency),
+        "--speech-latency",
+        str(args.speech_latency),
+        "--speech-bytes",
+        str(args.speech_bytes),
+    ]
+
+
+def app_env(args, workdir):
+    mock_url = f"http://127.0.0.1:{args.mock_port}"
+    env = dict(os.environ)
+    env.update(
+        {
+            "HOST": "127.0.0.1",
+            "PORT": str(args.port),
+            "WORKERS": str(args.workers),
+            "RELOAD": "0",
+            "OPENAI_API_KEY": "bench",
+            "OPENAI_BASE_URL": f"{mock_url}/v1",
+            "OLLAMA_BASE_URL": mock_url,
+            "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+            "LOG_LEVEL": "WARNING",
+            "LOG_FILE": os.path.join(workdir, "app.log"),
+            # Cada request debe llegar al mock, no al cache de respuestas
+            "COMPLETION_CACHE_TTL": "0",
+            # Todas las sesiones usan el mismo usuario: sin este ajuste el
+            # limite por usuario las encola y se mide la cola, no la app
+            "MAX_GENERATIONS_PER_USER": str(max(args.sessions, 1)),
+        }
+    )
+    return env
+
+
+async def wait_until_ready(url, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                response = await client.get(url)
+                if response.status_code < 500:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not start in {timeout}s")
+
+
+async def create_user(client: httpx.AsyncClient):
+    name = f"bench-{uuid.uuid4().hex[:8]}"
+    user = {"username": name, "email": f"{name}@bench.local", "password": "bench"}
+    response = await client.post("/signup/", json=user)
+    response.raise_for_status()
+    response = await client.post(
+        "/login/", json={"email": user["email"], "password": user["password"]}
+    )
+    response.raise_for_status()
+    return response.json()["token"]
+
+
+async def socket_session(app_url, token, messages, model, samples, http_session):
+    sio = socketio.AsyncClient(http_session=http_session)
+    state = {}
+
+    @sio.on("response")
+    async def on_response(data):
+        if state.get("ttft") is None:
+            state["ttft"] = time.perf_counter() - state["sent_at"]
+        state["chunks"] += 1
+
+    @sio.on("responseFinished")
+    async def on_finished(data):
+        state["ok"] = data.get("status") == "ok"
+        state["done"].set()
+
+    # /socket.io/ esta montado como ruta HTTP (GET/POST): solo polling
+    await sio.connect(app_url, transports=["polling"])
+    try:
+        for _ in range(messages):
+            state.update(
+                ttft=None, chunks=0, ok=False, done=asyncio.Event(),
+                sent_at=time.perf_counter(),
+            )
+            await sio.emit(
+                "message",
+                {
+                    "message": f"hola {uuid.uuid4().hex}",
+                    "context": "",
+                    "model": model,
+                    "token": token,
+                },
+            )
+            try:
+                await asyncio.wait_for(state["done"].wait(), 60)
+            except asyncio.TimeoutError:
+                state["ok"] = False
+            samples.append(
+                {
+                    "ok": state["ok"],
+                    "ttft": state["ttft"],
+                    "latency": time.perf_counter() - state["sent_at"],
+                    "chunks": state["chunks"],
+                    "finished_at": time.perf_counter(),
+                }
+            )
+    finally:
+        await sio.disconnect()
+        # Espera a que termine el long-poll pendiente antes de soltar la sesion
+        # (puede tardar hasta el ping interval; no entra en las metricas)
+        await sio.wait()
+
+
+async def run_socket_scenario(app_url, token, args):
+    samples = []
+    model = {"provider": args.provider, "name": args.model}
+    # Sesion HTTP compartida: si cada cliente cerrara la suya al desconectar,
+    # el long-poll pendiente fallaria al terminar
+    async with aiohttp.ClientSession() as http_session:
+        started = time.perf_counter()
+        outcomes = await asyncio.gather(
+            *(
+                socket_session(
+                    app_url, token, args.messages, model, samples, http_session
+                )
+                for _ in range(args.sessions)
+            ),
+            return_exceptions=True,
+        )
+        finished = [s["finished_at"] for s in samples if "finished_at" in s]
+        elapsed = max(finished, default=started) - started
+    # Una sesion que no pudo conectar cuenta como mensajes fallidos
+    for outcome in outcomes:
+        if isinstance(outcome, Exception):
+            samples.extend({"ok": False, "latency": 0.0} for _ in range(args.messages))
+    return {"socket_message": summarize(samples, elapsed)}
+
+
+async def timed_request(samples, send, stream=False):
+    started = time.perf_counter()
+    sample = {"ok": False, "latency": 0.0}
+    try:
+        if stream:
+            async with send() as response:
+                chunks = 0
+                async for _ in response.aiter_raw():
+                    if chunks == 0:
+                        sample["ttft"] = time.perf_counter() - started
+                    chunks += 1
+                sample["chunks"] = chunks
+                sample["ok"] = response.status_code < 400
+        else:
+            response = await send()
+            sample["ok"] = response.status_code < 400
+    except httpx.HTTPError:
+        pass
+    sample["latency"] = time.perf_counter() - started
+    samples.append(sample)
+
+
+async def rest_client(client: httpx.AsyncClient, token, args, results):
+    headers = {"Authorization": f"Token {token}"}
+    model = {"provider": args.provider, "name": args.model}
+    for _ in range(args.messages):
+        await timed_request(
+            results["get_completion"],
+            lambda: client.stream(
+                "POST",
+                "/get_completion/",
+                headers=headers,
+                json={"message": f"hola {uuid.uuid4().hex}", "model": model},
+            ),
+            stream=True,
+        )
+        await timed_request(
+            results["conversations"],
+            lambda: client.get("/conversations", headers=headers),
+        )
+        await timed_request(results["get_models"], lambda: client.get("/get-models"))
+        await timed_request(
+            results["generate_speech"],
+            lambda: client.stream(
+                "POST",
+                "/generate_speech/",
+                headers=headers,
+                json={"text": f"hola {uuid.uuid4().hex}"},
+            ),
+            stream=True,
+        )
+        # Bytes distintos en cada upload: el store deduplica por contenido
+        audio = os.urandom(16 * 1024)
+        await timed_request(
+            results["upload_audio"],
+            lambda: client.post(
+                "/upload-audio/",
+                headers=headers,
+                files={"file": ("bench.mp3", audio, "audio/mp3")},
+            ),
+        )
+
+
+async def run_rest_scenario(client, token, args):
+    names = [
+        "get_completion",
+        "conversations",
+        "get_models",
+        "generate_speech",
+        "upload_audio",
+    ]
+    results = {name: [] for name in names}
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(rest_client(client, token, args, results) for _ in range(args.sessions))
+    )
+    elapsed = time.perf_counter() - started
+    return {name: summarize(results[name], elapsed) for name in names}
+
+
+def print_report(report):
+    for name, summary in report["scenarios"].items():
+        line = (
+            f"{name:<16} n={summary['requests']:<5} err={summary['errors']:<4} "
+            f"{summary['throughput_rps']:7.1f} req/s  "
+            f"p50={summary['latency_p50_ms']:7.1f}ms p99={summary['latency_p99_ms']:7.1f}ms"
+        )
+        if "ttft_p50_ms" in summary:
+            line += (
+                f"  ttft p50={summary['ttft_p50_ms']:6.1f}ms "
+                f"p99={summary['ttft_p99_ms']:6.1f}ms"
+            )
+        if "chunks_per_second" in summary:
+            line += f"  {summary['chunks_per_second']:.0f} chunks/s"
+        print(line)
+    for label in ("memory_before", "memory_after"):
+        memory = report.get(label)
+        if memory:
+            print(
+                f"{label}: rss={memory['rss_kb'] / 1024:.1f}MB "
+                f"peak={memory['peak_rss_kb'] / 1024:.1f}MB"
+            )
+
+
+async def run(args, app_pid=None):
+    app_url = args.app_url or f"http://127.0.0.1:{args.port}"
+    await wait_until_ready(f"{app_url}/get-models")
+
+    limits = httpx.Limits(max_connections=args.sessions * 2)
+    async with httpx.AsyncClient(
+        base_url=app_url, limits=limits, timeout=httpx.Timeout(60.0)
+    ) as client:
+        token = await create_user(client)
+        report = {"config": vars(args), "scenarios": {}}
+        if app_pid is not None:
+            report["memory_before"] = process_memory(app_pid)
+
+        if args.scenario in ("socket", "all"):
+            report["scenarios"].update(await run_socket_scenario(app_url, token, args))
+        if args.scenario in ("rest", "all"):
+            report["scenarios"].update(await run_rest_scenario(client, token, args))
+
+        if app_pid is not None:
+            report["memory_after"] = process_memory(app_pid)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenario", choices=["socket", "rest", "all"], default="all")
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=3)
+    parser.add_argument("--provider", default="openai")
+    parser.add_argument("--model", default="gpt-4o-mini")
+    parser.add_argument("--app-url", help="Usar una app ya levantada")
+    parser.add_argument("--port", type=int, default=8911)
+    parser.add_argument("--mock-port", type=int, default=8900)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--json", action="store_true")
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    processes = []
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    try:
+        app_pid = None
+        if not args.app_url:
+            processes.append(subprocess.Popen(mock_command(args), cwd=ROOT))
+            # La app consulta el catalogo de modelos al arrancar
+            asyncio.run(wait_until_ready(f"http://127.0.0.1:{args.mock_port}/v1/models"))
+            app = subprocess.Popen(
+                [sys.executable, "main.py"], cwd=ROOT, env=app_env(args, workdir)
+            )
+            processes.append(app)
+            app_pid = app.pid
+        report = asyncio.run(run(args, app_pid))
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+    errors = sum(summary["errors"] for summary in report["scenarios"].values())
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,69 @@
+"""
+Benchmark: tormenta de logins contra la latencia de un chat en curso.
+
+Un "chat" simulado emite un evento cada 10ms mientras se verifican N
+passwords en paralelo, primero inline en el event loop (como antes) y
+despues con el pool de server.utils.passwords. Reporta logins/seg y la
+latencia p50/p99/max que ve el chat.
+
+    python -m benchmarks.login_throughput --logins 50
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from server.utils.passwords import pwd_context, verify_and_update_password
+
+
+async def chat_ticker(interval: float, delays: list, stop: asyncio.Event):
+    while not stop.is_set():
+        expected = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        delays.append(time.perf_counter() - expected)
+
+
+async def inline_verify(password: str, password_hash: str):
+    return pwd_context.verify_and_update(password, password_hash)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def run(name: str, verify, logins: int, password_hash: str):
+    delays = []
+    stop = asyncio.Event()
+    ticker = asyncio.create_task(chat_ticker(0.01, delays, stop))
+    await asyncio.sleep(0.05)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(verify("secret", password_hash) for _ in range(logins)))
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await ticker
+
+    print(
+        f"{name:<10} {logins / elapsed:8.1f} logins/s   chat delay "
+        f"p50={statistics.median(delays) * 1000:6.1f}ms "
+        f"p99={percentile(delays, 99) * 1000:6.1f}ms "
+        f"max={max(delays) * 1000:6.1f}ms"
+    )
+
+
+async def main(logins: int):
+    password_hash = pwd_context.hash("secret")
+    await run("inline", inline_verify, logins, password_hash)
+    await run("offloaded", verify_and_update_password, logins, password_hash)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.logins))
@@ -0,0 +1,243 @@
+"""
+Servidor local que imita a OpenAI y Ollama para benchmarks.
+
+Implementa chat completions (streaming y no), transcripciones, speech,
+embeddings, models, images y el /api/tags de Ollama, con latencia y
+velocidad de tokens configurables. La app se apunta aca con:
+
+    OPENAI_BASE_URL=http://127.0.0.1:8900/v1 OLLAMA_BASE_URL=http://127.0.0.1:8900
+
+    python -m benchmarks.mock_server --port 8900 --ttft 0.3 --token-rate 50
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import time
+
+import uvicorn
+from fastapi import FastAPI, Form, Request, UploadFile, File
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+
+
+class MockSettings:
+    def __init__(
+        self,
+        ttft: float = 0.3,
+        token_rate: float = 50,
+        tokens: int = 60,
+        transcription_latency: float = 0.5,
+        speech_latency: float = 0.2,
+        speech_bytes: int = 32 * 1024,
+        speech_rate: int = 64 * 1024,
+    ):
+        self.ttft = ttft
+        self.token_rate = token_rate
+        self.tokens = tokens
+        self.transcription_latency = transcription_latency
+        self.speech_latency = speech_latency
+        self.speech_bytes = speech_bytes
+        self.speech_rate = speech_rate
+
+    @property
+    def token_interval(self) -> float:
+        return 1 / self.token_rate if self.token_rate > 0 else 0
+
+
+def completion_tokens(settings: MockSettings, max_tokens=None):
+    count = settings.tokens if max_tokens is None else min(settings.tokens, max_tokens)
+    return [f"tok{i} " for i in range(count)]
+
+
+def create_mock_app(settings: MockSettings) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "gpt-4o-mini")
+        tokens = completion_tokens(settings, body.get("max_tokens"))
+
+        if not body.get("stream"):
+            await asyncio.sleep(settings.ttft + len(tokens) * settings.token_interval)
+            return {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": "".join(tokens)},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": 10,
+                    "completion_tokens": len(tokens),
+                    "total_tokens": 10 + len(tokens),
+                },
+            }
+
+        async def sse():
+            await asyncio.sleep(settings.ttft)
+            for i, token in enumerate(tokens):
+                if i:
+                    await asyncio.sleep(settings.token_interval)
+                chunk = {
+                    "id": "chatcmpl-mock",
+                    "object": "chat.completion.chunk",
+                    "created": 0,
+                    "model": model,
+                    "choices": [
+                        {"index": 0, "delta": {"content": token}, "finish_reason": None}
+                    ],
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+            if (body.get("stream_options") or {}).get("include_usage"):
+                chunk = {
+                    "id": "chatcmpl-mock",
+                    "object": "chat.completion.chunk",
+                    "created": 0,
+                    "model": model,
+                    "choices": [],
+                    "usage": {
+                        "prompt_tokens": 10,
+                        "completion_tokens": len(tokens),
+                        "total_tokens": 10 + len(tokens),
+                    },
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(sse(), media_type="text/event-stream")
+
+    @app.post("/v1/audio/transcriptions")
+    async def transcriptions(
+        file: UploadFile = File(...),
+        model: str = Form("whisper-1"),
+        response_format: str = Form("json"),
+    ):
+        size = len(await file.read())
+        await asyncio.sleep(settings.transcription_latency)
+        text = f"mock transcription of {size} bytes"
+        if response_format == "vtt":
+            return PlainTextResponse(f"WEBVTT\n\n00:00:00.000 --> 00:00:01.000\n{text}\n")
+        if response_format == "text":
+            return PlainTextResponse(text)
+        return {
+            "task": "transcribe",
+            "language": "english",
+            "duration": 1.0,
+            "text": text,
+            "segments": [],
+        }
+
+    @app.post("/v1/audio/speech")
+    async def speech(request: Request):
+        await request.json()
+        chunk_size = 4096
+        interval = chunk_size / settings.speech_rate if settings.speech_rate else 0
+
+        async def audio():
+            await asyncio.sleep(settings.speech_latency)
+            sent = 0
+            while sent < settings.speech_bytes:
+                size = min(chunk_size, settings.speech_bytes - sent)
+                yield b"\xff" * size
+                sent += size
+                await asyncio.sleep(interval)
+
+        return StreamingResponse(audio(), media_type="audio/mpeg")
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        data = []
+        for index, text in enumerate(inputs):
+            digest = hashlib.sha256(str(text).encode("utf-8")).digest()
+            data.append(
+                {
+                    "object": "embedding",
+                    "index": index,
+                    "embedding": [byte / 255 for byte in digest],
+                }
+            )
+        return {
+            "object": "list",
+            "data": data,
+            "model": body.get("model"),
+            "usage": {"prompt_tokens": 1, "total_tokens": 1},
+        }
+
+    @app.post("/v1/images/generations")
+    async def images(request: Request):
+        await request.json()
+        await asyncio.sleep(settings.ttft)
+        return {"created": int(time.time()), "data": [{"url": "http://mock/image.png"}]}
+
+    @app.get("/v1/models")
+    async def models():
+        names = ["gpt-4o-mini", "gpt-4o", "whisper-1", "tts-1"]
+        return {
+            "object": "list",
+            "data": [
+                {"id": name, "object": "model", "created": 0, "owned_by": "mock"}
+                for name in names
+            ],
+        }
+
+    @app.get("/api/tags")
+    async def ollama_tags():
+        return {
+            "models": [
+                {
+                    "name": "llama3.1:latest",
+                    "model": "llama3.1:latest",
+                    "size": 4661224676,
+                    "digest": "mock",
+                }
+            ]
+        }
+
+    @app.exception_handler(Exception)
+    async def on_error(request: Request, exc: Exception):
+        return JSONResponse(status_code=500, content={"error": {"message": str(exc)}})
+
+    return app
+
+
+def add_mock_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--ttft", type=float, default=0.3)
+    parser.add_argument("--token-rate", type=float, default=50)
+    parser.add_argument("--tokens", type=int, default=60)
+    parser.add_argument("--transcription-latency", type=float, default=0.5)
+    parser.add_argument("--speech-latency", type=float, default=0.2)
+    parser.add_argument("--speech-bytes", type=int, default=32 * 1024)
+
+
+def settings_from_args(args) -> MockSettings:
+    return MockSettings(
+        ttft=args.ttft,
+        token_rate=args.token_rate,
+        tokens=args.tokens,
+        transcription_latency=args.transcription_latency,
+        speech_latency=args.speech_latency,
+        speech_bytes=args.speech_bytes,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(
+        create_mock_app(settings_from_args(args)),
+        host=args.host,
+        port=args.port,
+        log_level="warning",
+    )
@@ -18,6 +18,9 @@ const socket = io("http://localhost:8000");
 
 export default function ChatView() {
   const [messages, setMessages] = useState([] as TMessage[]);
+  // El servidor crea la conversacion en el primer mensaje y arma el
+  // contexto a partir de ella en los siguientes
+  const [conversationId, setConversationId] = useState<number | null>(null);
 
 
   const { chatState, toggleSidebar, input, setInput, model } = useStore();
@@ -61,6 +64,9 @@ export default function ChatView() {
 
     socket.on("responseFinished", (data) => {
       console.log("Response finished:", data);
+      if (data.conversation_id) {
+        setConversationId(data.conversation_id);
+      }
       socket.disconnect()
     });
 
@@ -84,7 +90,13 @@ export default function ChatView() {
       const token = localStorage.getItem("token");
       socket.emit("message", {
         message: input,
-        context: messages.map((msg) => `${msg.sender}: ${msg.text}`).join("\n"),
+        ...(conversationId !== null
+          ? { conversation_id: conversationId }
+          : {
+              context: messages
+                .map((msg) => `${msg.sender}: ${msg.text}`)
+                .join("\n"),
+            }),
         model: model,
         token: token,
       });
@@ -191,11 +203,13 @@ const ChatHeader = ({ toggleSidebar, children }) => {
     try {
       const response = await fetch("/get-models");
       const json = await response.json();
-      const ollamaModels = json.map((model) => ({
+      const serverModels = json.map((model) => ({
         name: model.name,
-        provider: "ollama",
+        provider: model.provider || "ollama",
       }));
-      setModels([...models, ...ollamaModels]);
+      if (serverModels.length > 0) {
+        setModels(serverModels);
+      }
     } catch (e) {
       console.log(e);
     }
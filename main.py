@@ -1,18 +1,46 @@
 # main.py
 from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
 import uvicorn
+import asyncio
 import os
 from contextlib import asynccontextmanager
-from database import database  # Importar desde el nuevo módulo
+from database import (
+    connect_database,
+    disconnect_database,
+    migrate_once,
+    DATABASE_AUTO_CREATE,
+)
 from server.routes import router  # Importar el router desde el nuevo módulo
-from server.socket import sio_asgi_app  # Importar la configuración del socket
+from server.socket import (  # Importar la configuración del socket
+    sio_asgi_app,
+    start_message_queue,
+    SOCKETIO_MESSAGE_QUEUE,
+)
+from server.logger import logger
+from server.static import PrecompressedStaticFiles
+from server.utils.completions import close_provider_clients
+from server.utils.passwords import shutdown_password_executor
+from server.utils.model_catalog import warm_model_catalog
+from server.utils.usage import start_usage_flusher, stop_usage_flusher
+from server.utils.transcription_queue import (
+    start_transcription_workers,
+    stop_transcription_workers,
+)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    await database.connect()
+    await connect_database()
+    start_message_queue()
+    await start_transcription_workers()
+    warm_model_catalog()
+    start_usage_flusher()
     yield
-    await database.disconnect()
+    await stop_transcription_workers()
+    await close_provider_clients()
+    shutdown_password_executor()
+    # Ultimo flush del consumo en memoria, con la base todavia conectada
+    await stop_usage_flusher()
+    await disconnect_database()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -25,10 +53,40 @@ os.makedirs(AUDIO_DIR, exist_ok=True)
 app.include_router(router)
 
 # app.mount("/", StaticFiles(directory="client/dist", html=True), name="dist")
-app.mount("/assets", StaticFiles(directory="client/dist/assets"), name="static")
+app.mount(
+    "/assets",
+    PrecompressedStaticFiles(
+        directory="client/dist/assets",
+        hashed_manifest="client/dist/hashed-assets.json",
+    ),
+    name="static",
+)
 
 # Integrar el socket
 app.add_route("/socket.io/", route=sio_asgi_app, methods=["GET", "POST"])
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=True)
+    workers = int(os.environ.get("WORKERS", 1))
+    if workers > 1 and not SOCKETIO_MESSAGE_QUEUE:
+        logger.warning(
+            "WORKERS > 1 without SOCKETIO_MESSAGE_QUEUE: socket emits, logout "
+            "and organization config changes only reach the same worker"
+        )
+    if workers > 1:
+        # Ver "Multiple workers" en el README
+        logger.warning(
+            "WORKERS > 1: transcription jobs and MAX_GENERATIONS_PER_USER "
+            "are tracked per worker"
+        )
+        if DATABASE_AUTO_CREATE:
+            # El esquema se migra una vez aca y no en cada worker a la vez
+            asyncio.run(migrate_once())
+            os.environ["DATABASE_AUTO_CREATE"] = "0"
+    uvicorn.run(
+        "main:app",
+        host=os.environ.get("HOST", "127.0.0.1"),
+        port=int(os.environ.get("PORT", 8000)),
+        workers=workers,
+        # reload solo funciona con un worker
+        reload=workers == 1 and os.environ.get("RELOAD", "1") == "1",
+    )
@@ -0,0 +1,173 @@
+import asyncio
+import pickle
+from urllib.parse import urlparse
+
+import socketio
+from socketio.async_pubsub_manager import AsyncPubSubManager
+
+from .logger import logger
+
+# Mensajes entre workers que no son emits de socket.io (ej. invalidar un
+# cache en memoria). Viajan por la misma cola; socket.io no los ve.
+WORKER_MESSAGE = "worker_message"
+
+# kind -> funcion que se ejecuta en cada worker con el payload como kwargs
+_worker_handlers = {}
+
+
+def on_worker_message(kind: str, handler):
+    _worker_handlers[kind] = handler
+
+
+def _run_worker_handler(kind: str, payload: dict):
+    handler = _worker_handlers.get(kind)
+    if handler is None:
+        logger.warning(f"No handler for worker message: {kind}")
+        return
+    try:
+        handler(**payload)
+    except Exception as e:
+        logger.error(f"Worker message {kind} failed: {e}")
+
+
+async def publish_worker_message(manager, kind: str, **payload):
+    """
+    Ejecuta el handler de `kind` en este worker y, si hay cola de mensajes,
+    lo publica para que lo ejecuten los demas.
+    """
+    _run_worker_handler(kind, payload)
+    if isinstance(manager, AsyncPubSubManager):
+        await manager._publish(
+            {
+                "method": WORKER_MESSAGE,
+                "kind": kind,
+                "payload": payload,
+                "host_id": manager.host_id,
+            }
+        )
+
+
+class LocalFirstMixin:
+    """
+    Si el destino de un emit es un sid conectado a este worker, se entrega
+    directo sin pasar por la cola de mensajes. Con sticky sessions casi
+    todos los chunks de una completion caen en este caso; solo los emits a
+    clientes de otros workers (o a rooms) se publican.
+    """
+
+    async def emit(
+        self,
+        event,
+        data,
+        namespace=None,
+        room=None,
+        skip_sid=None,
+        callback=None,
+        to=None,
+        **kwargs,
+    ):
+        room = to or room
+        if (
+            isinstance(room, str)
+            and self.server is not None
+            and self.is_connected(room, namespace or "/")
+        ):
+            kwargs["ignore_queue"] = True
+        return await super().emit(
+            event,
+            data,
+            namespace=namespace,
+            room=room,
+            skip_sid=skip_sid,
+            callback=callback,
+            **kwargs,
+        )
+
+
+class WorkerMessagesMixin:
+    """
+    Separa los mensajes WORKER_MESSAGE del resto antes de que lleguen al
+    listener de socket.io. Lo demas sigue ya deserializado (el listener
+    acepta dicts), asi no se hace pickle.loads dos veces.
+    """
+
+    async def _listen(self):
+        async for message in super()._listen():
+            data = message
+            if isinstance(message, bytes):
+                try:
+                    data = pickle.loads(message)
+                except Exception:
+                    data = message
+            if isinstance(data, dict) and data.get("method") == WORKER_MESSAGE:
+                # El que publica ya lo ejecuto
+                if data.get("host_id") != self.host_id:
+                    _run_worker_handler(data["kind"], data["payload"])
+                continue
+            yield data
+
+
+class InMemoryQueueManager(AsyncPubSubManager):
+    """
+    Cola de mensajes dentro del proceso. Sirve para tests y desarrollo:
+    varios AsyncServer en el mismo proceso se comportan como workers
+    separados conectados por Redis.
+    """
+
+    name = "memory"
+    _channels = {}
+
+    def __init__(self, url="memory://", channel="socketio", write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self._queue = asyncio.Queue()
+        if not write_only:
+            InMemoryQueueManager._channels.setdefault(channel, []).append(self._queue)
+
+    async def _publish(self, data):
+        # Serializar igual que una cola real: cada worker recibe su copia
+        message = pickle.dumps(data)
+        for queue in InMemoryQueueManager._channels.get(self.channel, []):
+            queue.put_nowait(message)
+
+    async def _listen(self):
+        while True:
+            yield await self._queue.get()
+
+
+class InMemoryPubSubManager(
+    WorkerMessagesMixin, LocalFirstMixin, InMemoryQueueManager
+):
+    pass
+
+
+class RedisManager(WorkerMessagesMixin, LocalFirstMixin, socketio.AsyncRedisManager):
+    pass
+
+
+class AioPikaManager(
+    WorkerMessagesMixin, LocalFirstMixin, socketio.AsyncAioPikaManager
+):
+    pass
+
+
+CLIENT_MANAGERS = {
+    "memory": InMemoryPubSubManager,
+    "redis": RedisManager,
+    "rediss": RedisManager,
+    "amqp": AioPikaManager,
+    "amqps": AioPikaManager,
+}
+
+
+def create_client_manager(url: str, write_only: bool = False):
+    """
+    Manager segun el esquema de la URL de SOCKETIO_MESSAGE_QUEUE. Sin URL
+    se usa el manager local de un solo proceso.
+    """
+    if not url:
+        return socketio.AsyncManager()
+
+    scheme = urlparse(url).scheme
+    if scheme not in CLIENT_MANAGERS:
+        raise ValueError(f"Unsupported socket.io message queue: {url}")
+    return CLIENT_MANAGERS[scheme](url=url, write_only=write_only)
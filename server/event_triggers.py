@@ -1,6 +1,23 @@
-from openai import OpenAI
-from .utils.openai_functions import stream_completion
-from server.utils.completions import  get_system_prompt
+import asyncio
+import time
+from database import database
+from server.utils.completions import (
+    get_provider,
+    get_system_prompt,
+    create_streaming_completion,
+)
+from server.utils.emitter import CoalescingEmitter
+from server.utils.speech_pipeline import SentenceSpeaker
+from server.utils.context_window import build_context
+from server.utils.conversations import (
+    create_conversation,
+    get_user_conversation,
+    insert_message,
+)
+from server.utils.token_cache import resolve_token, is_expired
+from server.utils.generation_limits import generation_slot, is_saturated
+from server.utils.metrics import SOCKET_FIRST_CHUNK, model_label
+from server.utils.openai_functions import SPEECH_MEDIA_TYPES, SPEECH_VOICES
 
 from .logger import logger
 
@@ -8,24 +25,190 @@ from .logger import logger
 
 async def on_message_handler(socket_id, data, **kwargs):
     from server.socket import sio
-    context = data["context"]
+    received_at = time.perf_counter()
     message = data["message"]
     model = data["model"]
-    print(model, "MODEL TO GENERATE")
+    logger.debug("Model to generate: %s", model)
+    if isinstance(model, dict):
+        provider, model_name = model.get("provider", "openai"), model.get("name")
+    else:
+        provider, model_name = "openai", model
+
+    try:
+        get_provider(provider)
+    except ValueError as e:
+        await sio.emit(
+            "responseFinished", {"status": "error", "detail": str(e)}, to=socket_id
+        )
+        return
+
+    # El formato termina en el nombre del archivo del cache de audio: se
+    # valida igual que en /generate_speech/
+    if data.get("speak"):
+        error = None
+        if data.get("audio_format", "mp3") not in SPEECH_MEDIA_TYPES:
+            error = "Unsupported audio format"
+        elif data.get("voice", "alloy") not in SPEECH_VOICES:
+            error = "Unsupported voice"
+        if error is not None:
+            await sio.emit(
+                "responseFinished", {"status": "error", "detail": error}, to=socket_id
+            )
+            return
+
+    token = None
+    if data.get("token"):
+        token = await resolve_token(data["token"])
+        if token is not None and is_expired(token):
+            token = None
+
+    # Con conversation_id el contexto sale de los mensajes guardados; sin el
+    # se usa el contexto que manda el cliente y, si hay usuario, se crea la
+    # conversacion (el id vuelve en responseFinished para el siguiente turno)
+    conversation_id = data.get("conversation_id")
+    if conversation_id is not None:
+        if token is None or not await get_user_conversation(
+            conversation_id, token.user_id
+        ):
+            await sio.emit(
+                "responseFinished",
+                {"status": "error", "detail": "Conversation not found"},
+                to=socket_id,
+            )
+            return
+        context = await build_context(conversation_id)
+        await insert_message(conversation_id, "user", message)
+    else:
+        context = data.get("context", "")
+        if token is not None:
+            async with database.transaction():
+                conversation_id = await create_conversation(token.user_id)
+                await insert_message(conversation_id, "user", message)
+
     system_prompt = get_system_prompt(context=context)
 
-    data = {}
-    ai_response = ""
-    async for chunk in stream_completion(system_prompt, message):
-        if isinstance(chunk, str):
-            data["chunk"] = chunk
-            ai_response += chunk
-            await sio.emit("response", data, to=socket_id)
-
-    logger.debug(ai_response)
-    await sio.emit(
-        "responseFinished", {"status": "ok", "ai_response": ai_response}, to=socket_id
-    )
+    # Limite de generaciones simultaneas por usuario (o por socket si no hay
+    # token); las que sobran quedan en cola
+    limit_key = token.user_id if token is not None else socket_id
+    if is_saturated(limit_key):
+        await sio.emit("generationQueued", {"status": "queued"}, to=socket_id)
+
+    async with generation_slot(limit_key):
+        await generate_response(
+            sio,
+            socket_id,
+            data,
+            provider,
+            model_name,
+            system_prompt,
+            message,
+            conversation_id,
+            received_at=received_at,
+            user_id=token.user_id if token is not None else None,
+        )
+
+
+async def generate_response(
+    sio,
+    socket_id,
+    data,
+    provider,
+    model_name,
+    system_prompt,
+    message,
+    conversation_id,
+    received_at=None,
+    user_id=None,
+):
+    async def emit_chunk(chunk):
+        await sio.emit("response", {"chunk": chunk}, to=socket_id)
+
+    async def emit_audio(audio_data):
+        await sio.emit("audioChunk", audio_data, to=socket_id)
+
+    # Modo "speak": el audio de cada oracion se genera mientras el texto
+    # sigue llegando, en vez de esperar a responseFinished
+    speaker = None
+    if data.get("speak"):
+        speaker = SentenceSpeaker(
+            emit_audio,
+            voice=data.get("voice", "alloy"),
+            output_format=data.get("audio_format", "mp3"),
+            user_id=user_id,
+        )
+
+    emitter = CoalescingEmitter(emit_chunk)
+    if received_at is None:
+        received_at = time.perf_counter()
+    first_chunk = True
+    ai_response = None
+
+    async def save_partial():
+        # Lo generado hasta que se corto el stream tambien se guarda
+        if ai_response is None and conversation_id is not None and emitter.text:
+            await asyncio.shield(
+                insert_message(conversation_id, "assistant", emitter.text)
+            )
+
+    try:
+        async for chunk in create_streaming_completion(
+            provider, model_name, system_prompt, message, user_id=user_id
+        ):
+            if isinstance(chunk, str):
+                if first_chunk:
+                    # Lo que ve el usuario: proveedor mas nuestro overhead
+                    first_chunk = False
+                    SOCKET_FIRST_CHUNK.labels(
+                        provider=provider, model=model_label(model_name or "default")
+                    ).observe(time.perf_counter() - received_at)
+                await emitter.push(chunk)
+                if speaker is not None:
+                    speaker.feed(chunk)
+        await emitter.close()
+
+        ai_response = emitter.text
+        logger.debug(ai_response)
+        if conversation_id is not None and ai_response:
+            await insert_message(conversation_id, "assistant", ai_response)
+
+        if speaker is not None:
+            # El cliente se desconecta al recibir responseFinished y la
+            # desconexion cancela esta tarea: el audio pendiente va antes
+            await speaker.close()
+            await sio.emit("audioFinished", {"status": "ok"}, to=socket_id)
+        await sio.emit(
+            "responseFinished",
+            {
+                "status": "ok",
+                "ai_response": ai_response,
+                "conversation_id": conversation_id,
+            },
+            to=socket_id,
+        )
+    except asyncio.CancelledError:
+        # Cancelado por el cliente o por desconexion: el stream upstream ya
+        # se cerro al salir del async for
+        await save_partial()
+        raise
+    except Exception as e:
+        logger.error(f"Generation failed for {provider}/{model_name}: {e}")
+        await save_partial()
+        await sio.emit(
+            "responseFinished",
+            {
+                "status": "error",
+                "detail": "Generation failed",
+                "conversation_id": conversation_id,
+            },
+            to=socket_id,
+        )
+    finally:
+        # En cualquier salida: sin timers del emitter ni tareas de TTS
+        # esperando para siempre
+        emitter.cancel()
+        if speaker is not None:
+            speaker.cancel()
+
 
 def on_connect_handler(socket_id, **kwargs):
     # sio.emit("available_rooms", room_manager.get_rooms(), to=socket_id)
@@ -1,20 +1,117 @@
+import atexit
+import itertools
+import json
 import logging
-from logging.handlers import RotatingFileHandler
+import os
+import queue
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 import colorlog
 
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "DEBUG").upper()
+# Vacio: solo consola
+LOG_FILE = os.environ.get("LOG_FILE", "app.log")
+LOG_FILE_LEVEL = os.environ.get("LOG_FILE_LEVEL", "INFO").upper()
+LOG_FILE_MAX_BYTES = int(os.environ.get("LOG_FILE_MAX_BYTES", 10 * 1024 * 1024))
+LOG_FILE_BACKUP_COUNT = int(os.environ.get("LOG_FILE_BACKUP_COUNT", 5))
+# "json" (una linea por evento) o "text"
+LOG_FILE_FORMAT = os.environ.get("LOG_FILE_FORMAT", "json")
+# Niveles por modulo, ej: "openai_functions=DEBUG,routes=WARNING"
+LOG_LEVELS = os.environ.get("LOG_LEVELS", "")
+# Los logs por token solo se escriben 1 de cada N
+LOG_TOKEN_SAMPLE_EVERY = int(os.environ.get("LOG_TOKEN_SAMPLE_EVERY", 100))
+# Si la cola se llena se descartan registros en vez de bloquear
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", 10000))
+
+
+def log_file_for_process(log_file: str, workers: int, pid: int) -> str:
+    """
+    Con varios workers cada proceso rota su propio archivo: app.log pasa a ser
+    app.<pid>.log. RotatingFileHandler no es seguro entre procesos.
+    """
+    if workers <= 1:
+        return log_file
+    base, ext = os.path.splitext(log_file)
+    return f"{base}.{pid}{ext}"
+
+
+def parse_module_levels(spec: str):
+    levels = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        module, level = item.split("=", 1)
+        levels[module.strip()] = logging.getLevelName(level.strip().upper())
+    return levels
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        event = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "line": record.lineno,
+            "message": record.getMessage(),
+        }
+        if record.exc_text:
+            event["exception"] = record.exc_text
+        return json.dumps(event, ensure_ascii=False, default=str)
+
+
+class ModuleLevelFilter(logging.Filter):
+    """
+    Aplica el nivel configurado para cada modulo (LOG_LEVELS); los demas
+    usan LOG_LEVEL.
+    """
+
+    def __init__(self, default_level, module_levels):
+        super().__init__()
+        self.default_level = default_level
+        self.module_levels = module_levels
+
+    def filter(self, record):
+        return record.levelno >= self.module_levels.get(record.module, self.default_level)
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Del lado de la app solo se arma el mensaje y se encola; el formato y la
+    escritura a consola/archivo pasan en el hilo del QueueListener.
+    """
+
+    dropped = 0
+
+    def prepare(self, record):
+        record.message = record.getMessage()
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg = record.message
+        record.args = None
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            NonBlockingQueueHandler.dropped += 1
+
+
 # Create a custom logger
 logger = logging.getLogger("fastapi_logger")
+logger.propagate = False
 
-# Set the default log level
-logger.setLevel(logging.DEBUG)
+default_level = logging.getLevelName(LOG_LEVEL)
+module_levels = parse_module_levels(LOG_LEVELS)
+# El logger deja pasar el nivel mas bajo configurado; el filtro decide por modulo
+logger.setLevel(min([default_level, *module_levels.values()]))
 
 # Create handlers
 console_handler = logging.StreamHandler()
-file_handler = RotatingFileHandler("app.log", maxBytes=2000, backupCount=5)
-
-# Set log level for handlers
 console_handler.setLevel(logging.DEBUG)
-file_handler.setLevel(logging.INFO)
+handlers = [console_handler]
 
 # Create formatters and add them to handlers
 console_format = colorlog.ColoredFormatter(
@@ -27,11 +124,50 @@ console_format = colorlog.ColoredFormatter(
         'CRITICAL': 'bold_red',
     }
 )
-file_format = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+if LOG_FILE_FORMAT == "json":
+    file_format = JsonFormatter()
+else:
+    file_format = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 
 console_handler.setFormatter(console_format)
-file_handler.setFormatter(file_format)
 
-# Add handlers to the logger
-logger.addHandler(console_handler)
-logger.addHandler(file_handler)
+if LOG_FILE:
+    file_handler = RotatingFileHandler(
+        log_file_for_process(LOG_FILE, int(os.environ.get("WORKERS", 1)), os.getpid()),
+        maxBytes=LOG_FILE_MAX_BYTES,
+        backupCount=LOG_FILE_BACKUP_COUNT,
+    )
+    file_handler.setLevel(logging.getLevelName(LOG_FILE_LEVEL))
+    file_handler.setFormatter(file_format)
+    handlers.append(file_handler)
+
+# Los handlers con I/O viven detras de una cola, fuera del event loop
+log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+queue_handler = NonBlockingQueueHandler(log_queue)
+queue_handler.addFilter(ModuleLevelFilter(default_level, module_levels))
+logger.addHandler(queue_handler)
+
+listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+listener.start()
+
+
+def stop_logging():
+    # Vacia la cola y detiene el hilo; se puede llamar mas de una vez
+    if listener._thread is not None:
+        listener.stop()
+
+
+atexit.register(stop_logging)
+
+
+_token_counter = itertools.count()
+
+
+def debug_sampled(message, *args):
+    """
+    Para logs por token: solo 1 de cada LOG_TOKEN_SAMPLE_EVERY llega al logger.
+    """
+    if not logger.isEnabledFor(logging.DEBUG) or LOG_TOKEN_SAMPLE_EVERY <= 0:
+        return
+    if next(_token_counter) % LOG_TOKEN_SAMPLE_EVERY == 0:
+        logger.debug(message, *args, stacklevel=2)
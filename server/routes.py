@@ -1,28 +1,99 @@
-from fastapi import APIRouter, File, UploadFile, HTTPException, Request, Depends, Header
+from fastapi import (
+    APIRouter,
+    File,
+    Form,
+    UploadFile,
+    HTTPException,
+    Request,
+    Response,
+    Depends,
+    Header,
+    Query,
+)
 from pydantic import BaseModel
-from fastapi.responses import FileResponse, HTMLResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import (
+    FileResponse,
+    HTMLResponse,
+    JSONResponse,
+    StreamingResponse,
+)
+from starlette.background import BackgroundTask
 from server.utils.openai_functions import (
-    transcribe_audio,
-    create_completion_openai,
-    async_create_streaming_completion,
-    stream_completion,
     generate_speech_stream,
-    generate_image,
+    async_generate_image,
+    SPEECH_MEDIA_TYPES,
+    SPEECH_VOICES,
+)
+from server.utils.model_catalog import list_models
+from server.utils.transcription_queue import (
+    enqueue_transcription,
+    get_job,
+    job_user_ids,
+    in_flight_hashes,
+    serialize_job,
+)
+from server.utils.audio_store import store_upload, evict
+from server.utils.speech_cache import (
+    speech_cache_key,
+    lookup as speech_cache_lookup,
+    store as speech_cache_store,
+)
+from server.utils import token_cache
+from server.client_managers import on_worker_message
+from server.socket import publish_to_workers
+from server.utils.conversations import (
+    create_conversation,
+    insert_message,
+    user_conversations_query,
+    get_user_conversation,
+    conversation_messages_query,
+    conversation_export_query,
+)
+from server.utils.context_window import build_context
+from server.utils.usage import record_usage
+from server.utils.org_clients import openai_client_for, invalidate_organization
+from server.utils.passwords import hash_password, verify_and_update_password
+from server.logger import logger
+from server.static import SpaShell
+from server.utils.metrics import (
+    timed,
+    render_metrics,
+    metrics_enabled,
+    metrics_authorized,
+    DB_QUERY_SECONDS,
 )
-from server.utils.ollama_functions import list_ollama_models
 
-from server.utils.completions import create_completion, get_system_prompt
-from database import database, Conversation, Message, Audio, User, Token
-from datetime import datetime, timedelta
+from server.utils.completions import (
+    create_streaming_completion,
+    get_provider,
+    get_system_prompt,
+)
+from database import (
+    database,
+    Audio,
+    User,
+    Token,
+    Organization,
+    OrganizationConfig,
+)
+from datetime import datetime
 import os
-from sqlalchemy.orm import Session
-from database import SessionLocal
-from passlib.context import CryptContext
+import json
+import asyncio
+from database import TOKEN_LIFETIME
 import uuid
-from typing import List
+from typing import List, Optional
 
 router = APIRouter()
 
+# index.html en memoria: se sirve igual para todas las rutas de la SPA
+spa_shell = SpaShell(os.path.join("client", "dist", "index.html"))
+
+# Caches en memoria de cada worker que se invalidan via publish_to_workers
+on_worker_message("logout", token_cache.invalidate)
+on_worker_message("organization_config", invalidate_organization)
+
 SUPPORTED_FORMATS = {
     "flac",
     "m4a",
@@ -37,68 +108,170 @@ SUPPORTED_FORMATS = {
 }
 AUDIO_DIR = "audios"
 
-# Cambiar bcrypt por argon2
-pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
-
-
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 
-def verify_token(authorization: str = Header(None), db: Session = Depends(get_db)):
+async def verify_token(authorization: str = Header(None)):
     if authorization is None or not authorization.startswith("Token "):
         raise HTTPException(status_code=401, detail="Invalid or missing token")
 
     token_str = authorization.split(" ")[1]
-    token = db.query(Token).filter(Token.token == token_str).first()
+    token = await token_cache.resolve_token(token_str)
+
     if token is None:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+    if token_cache.is_expired(token):
+        token_cache.invalidate(token_str)
+        raise HTTPException(status_code=401, detail="Token expired")
+
     return token
 
 
+async def optional_token(authorization: str = Header(None)):
+    # Para rutas que no exigen login pero atribuyen el consumo si hay token
+    try:
+        return await verify_token(authorization)
+    except HTTPException:
+        return None
+
+
 # Definir el modelo de datos para la solicitud de generación de discurso
 class SpeechRequest(BaseModel):
     text: str
+    voice: str = "alloy"
+    model: str = "tts-1"
+    format: str = "mp3"
 
 
 @router.post("/generate_speech/")
-async def generate_speech(request: SpeechRequest):
-    output_path = os.path.join(AUDIO_DIR, "output.mp3")
-    await generate_speech_stream(request.text, output_path)
-    return FileResponse(output_path, media_type="audio/mpeg", filename="output.mp3")
+async def generate_speech(
+    request: SpeechRequest, token: Optional[Token] = Depends(optional_token)
+):
+    if request.format not in SPEECH_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="Unsupported audio format")
+    if request.voice not in SPEECH_VOICES:
+        raise HTTPException(status_code=400, detail="Unsupported voice")
+
+    media_type = SPEECH_MEDIA_TYPES[request.format]
+    cache_key = speech_cache_key(
+        request.text, request.voice, request.model, request.format
+    )
+    cached_path = speech_cache_lookup(cache_key)
+    if cached_path is not None and os.path.exists(cached_path):
+        return FileResponse(
+            cached_path,
+            media_type=media_type,
+            headers={"Cache-Control": "public, max-age=86400"},
+        )
+
+    user_id = token.user_id if token is not None else None
+    audio_stream = generate_speech_stream(
+        request.text,
+        model=request.model,
+        voice=request.voice,
+        output_format=request.format,
+        openai_client=await openai_client_for(user_id),
+    )
+    # Se espera el primer chunk antes de responder: si el proveedor falla,
+    # el cliente recibe un error HTTP en lugar de un audio cortado
+    try:
+        first_chunk = await audio_stream.__anext__()
+    except StopAsyncIteration:
+        first_chunk = b""
+    except Exception as e:
+        logger.error(f"Speech generation failed: {e}")
+        raise HTTPException(status_code=502, detail="Speech generation failed")
+
+    # El proveedor ya acepto el texto completo: se cobra aunque el cliente corte
+    record_usage(user_id, "speech", "openai", request.model, len(request.text))
+
+    # Los chunks enviados se guardan para llenar el cache al terminar
+    sent_chunks = [first_chunk]
+    stream_state = {"completed": False}
+
+    async def audio_generator():
+        try:
+            yield first_chunk
+            async for chunk in audio_stream:
+                sent_chunks.append(chunk)
+                yield chunk
+            stream_state["completed"] = True
+        finally:
+            await audio_stream.aclose()
+
+    async def cache_audio():
+        if stream_state["completed"]:
+            await run_in_threadpool(
+                speech_cache_store, cache_key, request.format, b"".join(sent_chunks)
+            )
+
+    return StreamingResponse(
+        audio_generator(),
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f'inline; filename="speech.{request.format}"',
+            "Cache-Control": "no-store",
+            "X-Accel-Buffering": "no",
+        },
+        background=BackgroundTask(cache_audio),
+    )
 
 
 @router.post("/upload-audio/")
 async def upload_audio(
-    file: UploadFile = File(...), token: Token = Depends(verify_token)
+    file: UploadFile = File(...),
+    socket_id: Optional[str] = Form(None),
+    wait: bool = Form(True),
+    token: Token = Depends(verify_token),
 ):
     if file.content_type.split("/")[1] not in SUPPORTED_FORMATS:
         raise HTTPException(status_code=400, detail="Unsupported file format")
 
-    audio_file_path = os.path.join(AUDIO_DIR, file.filename)
-    with open(audio_file_path, "wb") as audio_file:
-        while contents := await file.read(1024):
-            audio_file.write(contents)
+    # UploadFile ya esta en un archivo temporal: se copia al store en bloques
+    # grandes desde un thread, calculando el sha256 al mismo tiempo
+    content_hash, audio_file_path, file_size = await run_in_threadpool(
+        store_upload, file.file, file.content_type.split("/")[1]
+    )
 
-    with open(audio_file_path, "rb") as audio_file:
-        transcription = transcribe_audio(audio_file)
+    cached = await database.fetch_one(
+        Audio.__table__.select().where(Audio.content_hash == content_hash)
+    )
+    if cached is not None:
+        return {
+            "job_id": None,
+            "status": "done",
+            "file_size": file_size,
+            "transcription": cached["transcription"],
+            "error": None,
+        }
 
-    # Guardar en la base de datos
-    async with database.transaction():
-        query = Audio.__table__.insert().values(
-            filename=file.filename, transcription=transcription
+    try:
+        job = await enqueue_transcription(
+            file.filename, audio_file_path, socket_id, content_hash, token.user_id
         )
-        await database.execute(query)
+    except asyncio.QueueFull:
+        raise HTTPException(status_code=503, detail="Transcription queue is full")
+
+    await run_in_threadpool(evict, keep=in_flight_hashes())
+
+    if not wait:
+        # El resultado se consulta en /transcriptions/{job_id} o llega por
+        # socket.io en el evento "transcriptionFinished"
+        return JSONResponse(status_code=202, content=serialize_job(job))
+
+    await job["done"].wait()
+    if job["status"] == "error":
+        raise HTTPException(status_code=502, detail="Transcription failed")
+
+    return serialize_job(job)
+
 
-    return {
-        "file_size": os.path.getsize(audio_file_path),
-        "transcription": transcription,
-    }
+@router.get("/transcriptions/{job_id}")
+async def get_transcription_job(job_id: str, token: Token = Depends(verify_token)):
+    job = get_job(job_id)
+    # Un job ajeno responde igual que uno inexistente
+    if job is None or token.user_id not in job_user_ids(job):
+        raise HTTPException(status_code=404, detail="Transcription job not found")
+    return serialize_job(job)
 
 
 class Model(BaseModel):
@@ -108,56 +281,76 @@ class Model(BaseModel):
 
 class CompletionRequest(BaseModel):
     message: str
-    context: str
+    # Solo se usa si no llega conversation_id; con conversation_id el
+    # contexto se arma en el servidor a partir de los mensajes guardados
+    context: str = ""
     model: Model
+    conversation_id: Optional[int] = None
+
+
+async def save_assistant_message(conversation_id: int, response_chunks: List[str]):
+    if not response_chunks:
+        return
+
+    await insert_message(conversation_id, "assistant", "".join(response_chunks))
 
 
 @router.post("/get_completion/")
 async def get_completion(
     request: CompletionRequest,
     token: Token = Depends(verify_token),
-    db: Session = Depends(get_db),
 ):
-    system_prompt = get_system_prompt(context=request.context)
+    # Antes de guardar nada: un proveedor invalido no deja conversaciones
+    # huerfanas
+    try:
+        get_provider(request.model.provider)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    complete_response = ""
+    conversation_id = request.conversation_id
+    if conversation_id is not None:
+        if not await get_user_conversation(conversation_id, token.user_id):
+            raise HTTPException(status_code=404, detail="Conversation not found")
+        context = await build_context(conversation_id)
+    else:
+        context = request.context
 
-    async def event_generator():
-        async for chunk in stream_completion(
-            system_prompt,
-            request.message,
-            model=request.model.name,
-        ):
-            complete_response += chunk
-            yield chunk
+    system_prompt = get_system_prompt(context=context)
 
-    
     async with database.transaction():
         # Crear una nueva conversación si no existe
-        conversation_query = Conversation.__table__.insert().values(
-            user_id=token.user_id
-        )  # Include user_id
-        conversation_id = await database.execute(conversation_query)
+        if conversation_id is None:
+            conversation_id = await create_conversation(token.user_id)
 
         # Guardar el mensaje del usuario
-        user_message_query = Message.__table__.insert().values(
-            conversation_id=conversation_id,
-            sender="user",
-            text=request.message,
-            timestamp=datetime.utcnow(),
-        )
-        await database.execute(user_message_query)
+        await insert_message(conversation_id, "user", request.message)
+
+    # Los chunks se envian al cliente tal cual llegan y se guardan en una
+    # lista; la respuesta completa se une una sola vez al terminar.
+    response_chunks = []
 
-        # Guardar la respuesta del asistente
-        # assistant_message_query = Message.__table__.insert().values(
-        #     conversation_id=conversation_id,
-        #     sender="assistant",
-        #     text="".join([chunk async for chunk in response_chunks]),
-        #     timestamp=datetime.utcnow(),
-        # )
-        # await database.execute(assistant_message_query)
+    async def event_generator():
+        async for chunk in create_streaming_completion(
+            request.model.provider,
+            request.model.name,
+            system_prompt,
+            request.message,
+            user_id=token.user_id,
+        ):
+            response_chunks.append(chunk)
+            yield chunk
 
-    return StreamingResponse(event_generator(), media_type="text/event-stream")
+    # Guardar la respuesta del asistente cuando termina el stream, en una
+    # transacción corta que no se mantiene abierta durante la generación
+    background = BackgroundTask(
+        save_assistant_message, conversation_id, response_chunks
+    )
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={"X-Conversation-Id": str(conversation_id)},
+        background=background,
+    )
 
 
 class UserLogin(BaseModel):
@@ -172,28 +365,59 @@ class UserCreate(BaseModel):
 
 
 @router.post("/signup/")
-async def signup(user: UserCreate, db: Session = Depends(get_db)):
-    hashed_password = pwd_context.hash(user.password)
-    db_user = User(username=user.username, email=user.email, password=hashed_password)
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+async def signup(user: UserCreate):
+    hashed_password = await hash_password(user.password)
+    async with database.transaction():
+        await database.execute(
+            User.__table__.insert().values(
+                username=user.username, email=user.email, password=hashed_password
+            )
+        )
     return {"message": "User created successfully"}
 
 
 @router.post("/login/")
-async def login(user: UserLogin, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(User.email == user.email).first()
-    if not db_user or not pwd_context.verify(user.password, db_user.password):
+async def login(user: UserLogin):
+    db_user = await database.fetch_one(
+        User.__table__.select().where(User.email == user.email)
+    )
+    if not db_user:
+        raise HTTPException(status_code=400, detail="Invalid email or password")
+
+    is_valid, new_hash = await verify_and_update_password(
+        user.password, db_user["password"]
+    )
+    if not is_valid:
         raise HTTPException(status_code=400, detail="Invalid email or password")
 
     token_str = str(uuid.uuid4())
-    token = Token(user_id=db_user.id, token=token_str, is_permanent=False)
-    db.add(token)
-    db.commit()
-    db.refresh(token)
+    async with database.transaction():
+        if new_hash is not None:
+            # Los parametros de argon2 cambiaron: se guarda el hash nuevo
+            await database.execute(
+                User.__table__.update()
+                .where(User.id == db_user["id"])
+                .values(password=new_hash)
+            )
+        await database.execute(
+            Token.__table__.insert().values(
+                user_id=db_user["id"],
+                token=token_str,
+                is_permanent=False,
+                expiration_date=datetime.utcnow() + TOKEN_LIFETIME,
+            )
+        )
 
-    return {"message": "Login successful", "token": token.token}
+    return {"message": "Login successful", "token": token_str}
+
+
+@router.post("/logout/")
+async def logout(token: Token = Depends(verify_token)):
+    async with database.transaction():
+        await database.execute(Token.__table__.delete().where(Token.id == token.id))
+    # Todos los workers dejan de aceptar el token, no solo este
+    await publish_to_workers("logout", token_str=token.token)
+    return {"message": "Logout successful"}
 
 
 class ImageRequest(BaseModel):
@@ -204,28 +428,72 @@ class ImageRequest(BaseModel):
 async def generate_image_route(
     request: ImageRequest, token: Token = Depends(verify_token)
 ):
-    image_url = generate_image(request.prompt)
-    print(image_url)
+    try:
+        image_url = await async_generate_image(
+            request.prompt, openai_client=await openai_client_for(token.user_id)
+        )
+    except Exception as e:
+        logger.error(f"Image generation failed: {e}")
+        return {"image_url": f"Error generating image: {e}"}
+
+    record_usage(token.user_id, "image", "openai", "dall-e-3", 1)
     return {"image_url": image_url}
 
 
+class OrganizationConfigRequest(BaseModel):
+    OPENAI_API_KEY: str
+
+
+@router.put("/organization/config/")
+async def update_organization_config(
+    request: OrganizationConfigRequest, token: Token = Depends(verify_token)
+):
+    organization = await database.fetch_one(
+        Organization.__table__.select()
+        .where(Organization.owner_id == token.user_id)
+        .order_by(Organization.id)
+        .limit(1)
+    )
+    if organization is None:
+        raise HTTPException(status_code=404, detail="Organization not found")
+
+    async with database.transaction():
+        config = await database.fetch_one(
+            OrganizationConfig.__table__.select().where(
+                OrganizationConfig.organization_id == organization["id"]
+            )
+        )
+        if config is None:
+            query = OrganizationConfig.__table__.insert().values(
+                organization_id=organization["id"],
+                OPENAI_API_KEY=request.OPENAI_API_KEY,
+            )
+        else:
+            query = (
+                OrganizationConfig.__table__.update()
+                .where(OrganizationConfig.organization_id == organization["id"])
+                .values(OPENAI_API_KEY=request.OPENAI_API_KEY)
+            )
+        await database.execute(query)
+
+    # El proximo request ya usa la clave nueva, en todos los workers
+    await publish_to_workers(
+        "organization_config",
+        organization_id=organization["id"],
+        owner_id=token.user_id,
+    )
+    return {"message": "Organization config updated"}
+
+
 @router.get("/", response_class=HTMLResponse)
 async def get_root(request: Request):
-    file_path = os.path.join("client", "dist", "index.html")
-    if os.path.exists(file_path):
-        with open(file_path, "r") as file:
-            html_content = file.read()
-
-        return HTMLResponse(content=html_content)
-    return HTMLResponse(content="Page not found", status_code=404)
+    return spa_shell.response(request)
 
 
 @router.get("/get-models")
 async def get_models():
-    # print("models")
-    models = list_ollama_models()
-    # print(models)
-    return models
+    # Catalogo combinado de OpenAI, Ollama y Anthropic, cacheado en memoria
+    return await list_models()
 
 
 class MessageResponse(BaseModel):
@@ -237,6 +505,7 @@ class ConversationResponse(BaseModel):
     id: int
     user_id: int
     message_count: int
+    last_message_at: Optional[datetime] = None
 
     class Config:
         from_attributes = True
@@ -244,20 +513,29 @@ class ConversationResponse(BaseModel):
 
 @router.get("/conversations", response_model=List[ConversationResponse])
 async def get_user_conversations(
-    token: Token = Depends(verify_token), db: Session = Depends(get_db)
+    response: Response,
+    limit: int = Query(50, ge=1, le=200),
+    before: Optional[int] = None,
+    token: Token = Depends(verify_token),
 ):
-    user_id = token.user_id
-    conversations = db.query(Conversation).filter(Conversation.user_id == user_id).all()
-
-    serialized_conversations = []
-    for conversation in conversations:
-        message_count = len(conversation.messages)
-        serialized_conversation = ConversationResponse(
-            id=conversation.id,
-            user_id=conversation.user_id,
-            message_count=message_count,
+    with timed(DB_QUERY_SECONDS, operation="list_conversations"):
+        rows = await database.fetch_all(
+            user_conversations_query(token.user_id, limit=limit, before=before)
+        )
+
+    serialized_conversations = [
+        ConversationResponse(
+            id=row["id"],
+            user_id=row["user_id"],
+            message_count=row["message_count"],
+            last_message_at=row["last_message_at"],
         )
-        serialized_conversations.append(serialized_conversation)
+        for row in rows
+    ]
+
+    # Cursor para la siguiente pagina: ?before=<X-Next-Cursor>
+    if len(rows) == limit:
+        response.headers["X-Next-Cursor"] = str(rows[-1]["id"])
 
     return serialized_conversations
 
@@ -273,6 +551,7 @@ class ConversationDetailResponse(BaseModel):
     id: int
     user_id: int
     messages: List[MessageResponse]
+    next_cursor: Optional[int] = None
 
     class Config:
         from_attributes = True
@@ -283,48 +562,76 @@ class ConversationDetailResponse(BaseModel):
 )
 async def get_conversation(
     conversation_id: int,
+    limit: int = Query(50, ge=1, le=500),
+    before: Optional[int] = None,
+    format: str = Query("json", pattern="^(json|ndjson)$"),
     token: Token = Depends(verify_token),
-    db: Session = Depends(get_db),
 ):
-    conversation = (
-        db.query(Conversation)
-        .filter(
-            Conversation.id == conversation_id, Conversation.user_id == token.user_id
-        )
-        .first()
-    )
+    with timed(DB_QUERY_SECONDS, operation="get_conversation"):
+        conversation = await get_user_conversation(conversation_id, token.user_id)
 
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversation not found")
 
-    messages = (
-        db.query(Message).filter(Message.conversation_id == conversation_id).all()
-    )
+    if format == "ndjson":
+        # Exportacion completa: cada fila se serializa apenas sale del cursor
+        async def ndjson_generator():
+            async for row in database.iterate(
+                conversation_export_query(conversation_id)
+            ):
+                yield json.dumps(
+                    {
+                        "id": row["id"],
+                        "sender": row["sender"],
+                        "text": row["text"],
+                        "timestamp": row["timestamp"].isoformat()
+                        if row["timestamp"]
+                        else None,
+                    }
+                ) + "\n"
+
+        return StreamingResponse(ndjson_generator(), media_type="application/x-ndjson")
+
+    with timed(DB_QUERY_SECONDS, operation="conversation_messages"):
+        rows = await database.fetch_all(
+            conversation_messages_query(conversation_id, limit=limit, before=before)
+        )
+
+    # La ventana sale del mas nuevo al mas viejo; se devuelve en orden
+    # cronologico y el cursor apunta al mas viejo para pedir los anteriores
+    next_cursor = rows[-1]["id"] if len(rows) == limit else None
 
     return ConversationDetailResponse(
-        id=conversation.id,
-        user_id=conversation.user_id,
+        id=conversation["id"],
+        user_id=conversation["user_id"],
         messages=[
             MessageResponse(
-                id=msg.id, sender=msg.sender, text=msg.text, timestamp=msg.timestamp
+                id=row["id"],
+                sender=row["sender"],
+                text=row["text"],
+                timestamp=row["timestamp"],
             )
-            for msg in messages
+            for row in reversed(rows)
         ],
+        next_cursor=next_cursor,
     )
 
 
+@router.get("/metrics")
+async def get_metrics(authorization: str = Header(None)):
+    if not metrics_enabled():
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not metrics_authorized(authorization):
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid or missing metrics token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+
 @router.get("/{page_name}", response_class=HTMLResponse)
 async def get_page(request: Request, page_name: str):
-    print("RETURNING STATIC")
-    file_path = os.path.join("client", "dist", "index.html")
-    if os.path.exists(file_path):
-        with open(file_path, "r") as file:
-            html_content = file.read()
-        # data = routes_meta.get(page_name, routes_meta["defaults"])
-
-        # for key, value in data.items():
-        #     placeholder = f"{{{{{key}}}}}"
-        #     html_content = html_content.replace(placeholder, value)
-
-        return HTMLResponse(content=html_content)
-    return HTMLResponse(content="Page not found", status_code=404)
+    # data = routes_meta.get(page_name, routes_meta["defaults"])
+    return spa_shell.response(request)
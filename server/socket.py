@@ -1,15 +1,40 @@
 # server/socket.py
+import os
 import socketio
 # Register the namespace
 from .socket_manager import ProxyNamespaceManager
+from .client_managers import create_client_manager, publish_worker_message
+
+# Con varios workers hace falta una cola compartida (redis://, amqp://) para
+# que un emit llegue al socket aunque este conectado a otro proceso.
+# "memory://" simula la cola dentro de un solo proceso para tests.
+SOCKETIO_MESSAGE_QUEUE = os.environ.get("SOCKETIO_MESSAGE_QUEUE", "")
+# El transporte polling necesita sticky sessions en el balanceador. Sin
+# ellas, usar SOCKETIO_TRANSPORTS=websocket.
+SOCKETIO_TRANSPORTS = os.environ.get("SOCKETIO_TRANSPORTS", "polling,websocket")
 
 
 sio = socketio.AsyncServer(
     async_mode="asgi",
     cors_allowed_origins="*",
+    client_manager=create_client_manager(SOCKETIO_MESSAGE_QUEUE),
+    transports=SOCKETIO_TRANSPORTS.split(","),
 )
 
 
 sio.register_namespace(ProxyNamespaceManager("/"))
 
 sio_asgi_app = socketio.ASGIApp(socketio_server=sio)
+
+
+def start_message_queue():
+    # socket.io empieza a escuchar la cola con la primera conexion; los
+    # mensajes entre workers tienen que llegar aunque no haya ninguna
+    if not sio.manager_initialized:
+        sio.manager_initialized = True
+        sio.manager.initialize()
+
+
+async def publish_to_workers(kind: str, **payload):
+    """Ejecuta un handler registrado con on_worker_message en todos los workers."""
+    await publish_worker_message(sio.manager, kind, **payload)
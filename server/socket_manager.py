@@ -1,3 +1,4 @@
+import asyncio
 import socketio
 from .logger import logger
 from .event_triggers import (
@@ -9,6 +10,11 @@ from .event_triggers import (
 
 
 class ProxyNamespaceManager(socketio.AsyncNamespace):
+    def __init__(self, namespace=None):
+        super().__init__(namespace)
+        # sid -> generaciones en curso, para poder cancelarlas
+        self.generations = {}
+
     async def on_start(self, sid, data):
         await on_start_handler(sid, data)
 
@@ -19,7 +25,33 @@ class ProxyNamespaceManager(socketio.AsyncNamespace):
         on_connect_handler(socket_id=sid)
 
     async def on_message(self, sid, message_data):
-        await on_message_handler(socket_id=sid, data=message_data)
+        task = asyncio.create_task(
+            on_message_handler(socket_id=sid, data=message_data)
+        )
+        self.generations.setdefault(sid, set()).add(task)
+        try:
+            await task
+        except asyncio.CancelledError:
+            # Si lo que se cancelo es este handler (p.ej. shutdown), propagar
+            if not task.cancelled():
+                raise
+            logger.info(f"Generation for {sid} cancelled")
+        finally:
+            tasks = self.generations.get(sid)
+            if tasks is not None:
+                tasks.discard(task)
+                if not tasks:
+                    self.generations.pop(sid, None)
+
+    async def on_cancel(self, sid, data=None):
+        if self.cancel_generations(sid):
+            await self.emit("responseFinished", {"status": "cancelled"}, to=sid)
+
+    def cancel_generations(self, sid):
+        tasks = self.generations.pop(sid, set())
+        for task in tasks:
+            task.cancel()
+        return len(tasks)
 
 
     def on_test(self, sid, data):
@@ -28,4 +60,5 @@ class ProxyNamespaceManager(socketio.AsyncNamespace):
 
 
     def on_disconnect(self, sid):
-        logger.info(f"Client {sid} disconnected")
+        cancelled = self.cancel_generations(sid)
+        logger.info(f"Client {sid} disconnected, {cancelled} generations cancelled")
@@ -0,0 +1,186 @@
+import gzip
+import hashlib
+import json
+import os
+import time
+from mimetypes import guess_type
+
+import anyio
+from fastapi import Request
+from fastapi.responses import FileResponse, HTMLResponse, Response
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.staticfiles import NotModifiedResponse
+
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE = "no-cache"
+
+# Orden de preferencia y extension de cada encoding precomprimido
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+
+
+def accepted_encodings(headers: Headers):
+    accept = headers.get("accept-encoding", "")
+    return {part.split(";")[0].strip() for part in accept.split(",")}
+
+
+class SpaShell:
+    """
+    index.html en memoria, con sus variantes comprimidas y un ETag fuerte
+    por variante. Se recarga cuando cambia el archivo en disco (se revisa
+    el mtime como mucho una vez por `check_interval` segundos).
+    """
+
+    def __init__(self, path: str, check_interval: float = 1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.variants = None  # encoding -> (body, etag)
+        self._signature = None
+        self._checked_at = 0.0
+
+    def _load(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self.variants = None
+            self._signature = None
+            return
+
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if signature == self._signature:
+            return
+
+        with open(self.path, "rb") as file:
+            body = file.read()
+        digest = hashlib.sha256(body).hexdigest()[:32]
+
+        variants = {"identity": (body, f'"{digest}"')}
+        for encoding, extension in ENCODINGS:
+            compressed_path = self.path + extension
+            if os.path.exists(compressed_path):
+                with open(compressed_path, "rb") as file:
+                    compressed = file.read()
+            elif encoding == "gzip":
+                compressed = gzip.compress(body, compresslevel=9)
+            else:
+                continue
+            variants[encoding] = (compressed, f'"{digest}-{encoding}"')
+
+        self.variants = variants
+        self._signature = signature
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self.variants is None or now - self._checked_at >= self.check_interval:
+            self._checked_at = now
+            self._load()
+
+    def response(self, request: Request) -> Response:
+        self._refresh()
+        if self.variants is None:
+            return HTMLResponse(content="Page not found", status_code=404)
+
+        encoding = "identity"
+        accepted = accepted_encodings(request.headers)
+        for candidate, _ in ENCODINGS:
+            if candidate in accepted and candidate in self.variants:
+                encoding = candidate
+                break
+
+        body, etag = self.variants[encoding]
+        headers = {
+            "ETag": etag,
+            "Cache-Control": REVALIDATE_CACHE,
+            "Vary": "Accept-Encoding",
+        }
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+
+        if_none_match = request.headers.get("if-none-match", "")
+        if etag in [tag.strip() for tag in if_none_match.split(",")]:
+            return Response(status_code=304, headers=headers)
+
+        return HTMLResponse(content=body, headers=headers)
+
+
+class HashedAssets:
+    """
+    Nombres de los assets con hash (bundle-3f9a1c2b.js), leidos de la lista
+    que escribe el build de Vite (plugin hashedAssets en vite.config.ts).
+    Se decide por la lista y no por el nombre: start-recording.mp3 parece
+    tener hash pero cambia sin cambiar de nombre.
+    """
+
+    def __init__(self, path: str, check_interval: float = 1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.names = frozenset()
+        self._signature = None
+        self._checked_at = None
+
+    def _load(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self.names = frozenset()
+            self._signature = None
+            return
+
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if signature == self._signature:
+            return
+
+        with open(self.path, "rb") as file:
+            self.names = frozenset(json.load(file))
+        self._signature = signature
+
+    def __contains__(self, path: str) -> bool:
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at >= self.check_interval:
+            self._checked_at = now
+            self._load()
+        return path in self.names
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """
+    StaticFiles que sirve el .br/.gz generado en el build cuando el cliente
+    lo acepta, y marca como immutable los assets con hash en el nombre.
+    """
+
+    def __init__(self, *args, hashed_manifest: str = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.hashed = HashedAssets(hashed_manifest) if hashed_manifest else ()
+
+    async def get_response(self, path: str, scope) -> Response:
+        accepted = accepted_encodings(Headers(scope=scope))
+        for encoding, extension in ENCODINGS:
+            if encoding not in accepted:
+                continue
+            full_path, stat_result = await anyio.to_thread.run_sync(
+                self.lookup_path, path + extension
+            )
+            if stat_result is None:
+                continue
+            # El tipo es el del archivo original, no el del comprimido
+            media_type, _ = guess_type(path)
+            response = FileResponse(
+                full_path,
+                stat_result=stat_result,
+                media_type=media_type or "application/octet-stream",
+                headers={"content-encoding": encoding},
+            )
+            if self.is_not_modified(response.headers, Headers(scope=scope)):
+                response = NotModifiedResponse(response.headers)
+            return self._with_cache_headers(path, response)
+
+        response = await super().get_response(path, scope)
+        return self._with_cache_headers(path, response)
+
+    def _with_cache_headers(self, path: str, response: Response) -> Response:
+        response.headers["vary"] = "Accept-Encoding"
+        if path in self.hashed:
+            response.headers["cache-control"] = IMMUTABLE_CACHE
+        else:
+            response.headers["cache-control"] = REVALIDATE_CACHE
+        return response
@@ -3,17 +3,60 @@ import base64
 import httpx
 import os
 
+from .usage import CompletionUsage
+
 # Obtener la clave de la API desde una variable de entorno
 api_key = os.getenv("ANTHROPIC_API_KEY")
 
-if not api_key:
-    raise ValueError("La clave de la API no está configurada en la variable de entorno 'ANTHROPIC_API_KEY'")
+# Configurar la clave de la API. Sin clave el servidor arranca igual y solo
+# falla el proveedor "anthropic" cuando se usa.
+anthropic_client = anthropic.Anthropic(api_key=api_key) if api_key else None
+
+async_anthropic_client = (
+    anthropic.AsyncAnthropic(
+        api_key=api_key,
+        http_client=httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+            timeout=httpx.Timeout(60.0, connect=10.0),
+        ),
+    )
+    if api_key
+    else None
+)
+
+
+def _require_client(client):
+    if client is None:
+        raise ValueError("La clave de la API no está configurada en la variable de entorno 'ANTHROPIC_API_KEY'")
+    return client
+
+
+async def close_anthropic_client():
+    if async_anthropic_client is not None:
+        await async_anthropic_client.close()
+
+
+async def stream_completion_anthropic(
+    system_prompt, user_message, model="claude-3-5-sonnet-20240620"
+):
+    client = _require_client(async_anthropic_client)
+    async with client.messages.stream(
+        model=model,
+        max_tokens=1024,
+        system=system_prompt,
+        messages=[{"role": "user", "content": user_message}],
+    ) as stream:
+        async for text in stream.text_stream:
+            yield text
+        # Tokens que informa Anthropic para el mensaje completo
+        message = await stream.get_final_message()
+        yield CompletionUsage(
+            message.usage.input_tokens, message.usage.output_tokens
+        )
 
-# Configurar la clave de la API
-anthropic_client = anthropic.Anthropic(api_key=api_key)
 
 def make_message_request():
-    message = anthropic_client.messages.create(
+    message = _require_client(anthropic_client).messages.create(
         model="claude-3-5-sonnet-20240620",
         max_tokens=1024,
         messages=[
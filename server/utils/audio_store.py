@@ -0,0 +1,98 @@
+import hashlib
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+AUDIO_DIR = "audios"
+BLOB_DIR = os.path.join(AUDIO_DIR, "blobs")
+AUDIO_STORE_MAX_BYTES = int(
+    os.environ.get("AUDIO_STORE_MAX_BYTES", 2 * 1024 * 1024 * 1024)
+)
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# Indice LRU de los blobs guardados: digest -> (path, size). El mas viejo
+# queda al principio. Se arma desde el disco la primera vez que se usa.
+_index = None
+_total_bytes = 0
+_lock = threading.Lock()
+
+
+def _load_index():
+    global _index, _total_bytes
+    os.makedirs(BLOB_DIR, exist_ok=True)
+    entries = []
+    for entry in os.scandir(BLOB_DIR):
+        if entry.is_file() and not entry.name.startswith("."):
+            stat = entry.stat()
+            digest = entry.name.split(".")[0]
+            entries.append((stat.st_mtime, digest, entry.path, stat.st_size))
+
+    _index = OrderedDict()
+    _total_bytes = 0
+    for _, digest, path, size in sorted(entries):
+        _index[digest] = (path, size)
+        _total_bytes += size
+
+
+def _ensure_index():
+    if _index is None:
+        _load_index()
+
+
+def store_upload(source, extension: str):
+    """
+    Copia el upload al store calculando el sha256 mientras se escribe.
+    Cada contenido se guarda una sola vez en BLOB_DIR/<digest>.<extension>.
+    Devuelve (digest, path, size). Bloqueante: llamar desde un thread.
+    """
+    global _total_bytes
+    os.makedirs(BLOB_DIR, exist_ok=True)
+    hasher = hashlib.sha256()
+    size = 0
+    tmp_path = os.path.join(BLOB_DIR, f".upload-{uuid.uuid4()}")
+
+    source.seek(0)
+    with open(tmp_path, "wb") as tmp_file:
+        while block := source.read(COPY_BUFFER_SIZE):
+            hasher.update(block)
+            tmp_file.write(block)
+            size += len(block)
+
+    digest = hasher.hexdigest()
+    path = os.path.join(BLOB_DIR, f"{digest}.{extension}")
+
+    with _lock:
+        _ensure_index()
+        if digest in _index:
+            os.remove(tmp_path)
+            path, size = _index[digest]
+            _index.move_to_end(digest)
+            os.utime(path)
+        else:
+            os.replace(tmp_path, path)
+            _index[digest] = (path, size)
+            _total_bytes += size
+
+    return digest, path, size
+
+
+def evict(max_bytes: int = AUDIO_STORE_MAX_BYTES, keep=()):
+    """
+    Borra los blobs menos usados hasta quedar por debajo de max_bytes.
+    Los digests en `keep` (trabajos en curso) no se borran.
+    """
+    global _total_bytes
+    with _lock:
+        _ensure_index()
+        for digest in list(_index):
+            if _total_bytes <= max_bytes:
+                break
+            if digest in keep:
+                continue
+            path, size = _index.pop(digest)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            _total_bytes -= size
@@ -0,0 +1,184 @@
+import asyncio
+import hashlib
+import math
+import operator
+import os
+import time
+from collections import OrderedDict
+
+from .org_clients import openai_client_for
+from .usage import record_usage
+from ..logger import logger
+
+COMPLETION_CACHE_TTL = float(os.environ.get("COMPLETION_CACHE_TTL", 3600))
+COMPLETION_CACHE_MAX_ENTRIES = int(os.environ.get("COMPLETION_CACHE_MAX_ENTRIES", 1000))
+# Modo opcional: mensajes casi iguales (por embeddings) comparten respuesta
+COMPLETION_CACHE_SEMANTIC = os.environ.get("COMPLETION_CACHE_SEMANTIC", "0") == "1"
+COMPLETION_CACHE_SIMILARITY = float(os.environ.get("COMPLETION_CACHE_SIMILARITY", 0.97))
+COMPLETION_CACHE_EMBEDDING_MODEL = os.environ.get(
+    "COMPLETION_CACHE_EMBEDDING_MODEL", "text-embedding-3-small"
+)
+# La busqueda semantica recorre todo el bucket: se limita cuantas entradas
+# se comparan por pedido
+COMPLETION_CACHE_SEMANTIC_MAX_PER_BUCKET = int(
+    os.environ.get("COMPLETION_CACHE_SEMANTIC_MAX_PER_BUCKET", 200)
+)
+REPLAY_CHUNK_CHARS = 24
+
+# key -> (respuesta, monotonic de expiracion)
+_cache = OrderedDict()
+# bucket -> OrderedDict(key -> (embedding, norma)); bucket agrupa por
+# proveedor, modelo y prompt. La norma se calcula una vez al guardar.
+_embeddings = {}
+# key -> bucket, para sacar el embedding cuando la respuesta expira
+_embedding_buckets = {}
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.split())
+
+
+def _hash(*parts: str) -> str:
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+
+def completion_cache_key(provider: str, model: str, system_prompt: str, message: str):
+    return _hash(
+        provider, model, _normalize(system_prompt), _normalize(message).casefold()
+    )
+
+
+def _bucket(provider: str, model: str, system_prompt: str):
+    return _hash(provider, model, _normalize(system_prompt))
+
+
+def get(key: str):
+    entry = _cache.get(key)
+    if entry is None:
+        return None
+    response, expires_at = entry
+    if expires_at <= time.monotonic():
+        _cache.pop(key, None)
+        _forget_embedding(key)
+        return None
+    _cache.move_to_end(key)
+    return response
+
+
+def put(key: str, response: str):
+    _cache[key] = (response, time.monotonic() + COMPLETION_CACHE_TTL)
+    _cache.move_to_end(key)
+    while len(_cache) > COMPLETION_CACHE_MAX_ENTRIES:
+        old_key, _ = _cache.popitem(last=False)
+        _forget_embedding(old_key)
+
+
+def _norm(vector) -> float:
+    return math.sqrt(sum(map(operator.mul, vector, vector)))
+
+
+def _remember_embedding(key: str, bucket: str, embedding):
+    entries = _embeddings.setdefault(bucket, OrderedDict())
+    entries[key] = (embedding, _norm(embedding))
+    entries.move_to_end(key)
+    _embedding_buckets[key] = bucket
+    while len(entries) > COMPLETION_CACHE_SEMANTIC_MAX_PER_BUCKET:
+        old_key, _ = entries.popitem(last=False)
+        _embedding_buckets.pop(old_key, None)
+
+
+def _forget_embedding(key: str):
+    bucket = _embedding_buckets.pop(key, None)
+    if bucket is None:
+        return
+    entries = _embeddings[bucket]
+    entries.pop(key, None)
+    if not entries:
+        del _embeddings[bucket]
+
+
+async def _embed(text: str, user_id=None):
+    # Con la clave de la organizacion del usuario, y facturado como el resto
+    openai_client = await openai_client_for(user_id)
+    response = await openai_client.embeddings.create(
+        model=COMPLETION_CACHE_EMBEDDING_MODEL, input=_normalize(text)
+    )
+    record_usage(
+        user_id,
+        "embedding",
+        "openai",
+        COMPLETION_CACHE_EMBEDDING_MODEL,
+        response.usage.prompt_tokens,
+    )
+    return response.data[0].embedding
+
+
+def _best_match(entries, embedding):
+    """Clave mas parecida por coseno (o None). Bloqueante."""
+    norm = _norm(embedding)
+    if not norm:
+        return None
+    best_key, best_score = None, COMPLETION_CACHE_SIMILARITY
+    for key, entry_embedding, entry_norm in entries:
+        if not entry_norm:
+            continue
+        dot = sum(map(operator.mul, embedding, entry_embedding))
+        score = dot / (norm * entry_norm)
+        if score >= best_score:
+            best_key, best_score = key, score
+    return best_key
+
+
+async def _semantic_lookup(bucket: str, embedding):
+    entries = _embeddings.get(bucket)
+    if not entries:
+        return None
+    # Copia de las entradas: el recorrido corre en un thread, fuera del
+    # event loop, mientras otros pedidos pueden modificar el cache
+    snapshot = [(key, vector, norm) for key, (vector, norm) in entries.items()]
+    best_key = await asyncio.to_thread(_best_match, snapshot, embedding)
+    return get(best_key) if best_key is not None else None
+
+
+async def replay(response: str):
+    # Se devuelve en pedazos como si viniera del proveedor, para que el
+    # cliente no note la diferencia entre un hit y una generacion real
+    for start in range(0, len(response), REPLAY_CHUNK_CHARS):
+        yield response[start : start + REPLAY_CHUNK_CHARS]
+        await asyncio.sleep(0)
+
+
+async def cached_stream(
+    provider, model, system_prompt, message, stream_factory, user_id=None
+):
+    key = completion_cache_key(provider, model, system_prompt, message)
+    response = get(key)
+
+    embedding = None
+    if response is None and COMPLETION_CACHE_SEMANTIC:
+        try:
+            embedding = await _embed(message, user_id)
+            response = await _semantic_lookup(
+                _bucket(provider, model, system_prompt), embedding
+            )
+        except Exception as e:
+            logger.error(f"Completion cache embedding failed: {e}")
+
+    if response is not None:
+        async for piece in replay(response):
+            yield piece
+        return
+
+    parts = []
+    async for chunk in stream_factory():
+        parts.append(chunk)
+        yield chunk
+
+    # Solo se cachean respuestas completas: si el consumidor corta el
+    # stream (cancelacion, desconexion) no se llega hasta aca
+    if parts and COMPLETION_CACHE_TTL > 0:
+        put(key, "".join(parts))
+        if embedding is not None:
+            _remember_embedding(
+                key, _bucket(provider, model, system_prompt), embedding
+            )
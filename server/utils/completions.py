@@ -1,23 +1,104 @@
-from .ollama_functions import create_completion_ollama
-from .openai_functions import create_completion_openai
-from .anthropic_functions import make_message_request
+from .ollama_functions import stream_completion_ollama, close_ollama_client
+from .openai_functions import stream_completion, close_async_clients
+from .anthropic_functions import stream_completion_anthropic, close_anthropic_client
+from .completion_cache import cached_stream
+from .metrics import timed_stream
+from .usage import metered_stream
+from .org_clients import openai_client_for
+from ..logger import logger
 
-def create_completion(provider: str, model: str, system_prompt: str, user_message: str):
-    print("Generating completion with ", provider)
+# Registro de proveedores: cada uno expone la misma interfaz de streaming
+# stream(system_prompt, user_message, model) y un cliente con pool de conexiones
+# creado una sola vez al importar el modulo. `client_for(user_id)` es opcional:
+# devuelve el cliente con la clave de la organizacion del usuario.
+PROVIDERS = {}
 
-    if provider == "openai":
-        res = create_completion_openai(system_prompt, user_message, model=model)
 
-    if provider == "ollama":
-        res = create_completion_ollama(system_prompt, user_message, model=model)
+def register_provider(name: str, stream, close, default_model: str, client_for=None):
+    PROVIDERS[name] = {
+        "stream": stream,
+        "close": close,
+        "default_model": default_model,
+        "client_for": client_for,
+    }
 
-    make_message_request()
-    return res
 
+register_provider(
+    "openai",
+    stream_completion,
+    close_async_clients,
+    "gpt-4o-mini",
+    client_for=openai_client_for,
+)
+register_provider("ollama", stream_completion_ollama, close_ollama_client, "llama3.1")
+register_provider(
+    "anthropic",
+    stream_completion_anthropic,
+    close_anthropic_client,
+    "claude-3-5-sonnet-20240620",
+)
 
 
-def create_streaming_completion(provider: str, model: str, system_prompt: str, user_message: str):
-    pass
+def get_provider(provider: str):
+    if provider not in PROVIDERS:
+        raise ValueError(f"Unknown completion provider: {provider}")
+    return PROVIDERS[provider]
+
+
+async def close_provider_clients():
+    for provider in PROVIDERS.values():
+        await provider["close"]()
+
+
+async def create_completion(
+    provider: str, model: str, system_prompt: str, user_message: str, user_id=None
+):
+    chunks = [
+        chunk
+        async for chunk in create_streaming_completion(
+            provider, model, system_prompt, user_message, user_id=user_id
+        )
+    ]
+    return "".join(chunks)
+
+
+def create_streaming_completion(
+    provider: str, model: str, system_prompt: str, user_message: str, user_id=None
+):
+    backend = get_provider(provider)
+    model = model or backend["default_model"]
+    logger.debug(f"Generating completion with {provider}")
+
+    async def upstream():
+        kwargs = {}
+        if backend["client_for"] is not None and user_id is not None:
+            kwargs["openai_client"] = await backend["client_for"](user_id)
+        async for chunk in backend["stream"](
+            system_prompt, user_message, model=model, **kwargs
+        ):
+            yield chunk
+
+    return cached_stream(
+        provider,
+        model,
+        system_prompt,
+        user_message,
+        # Metricas y consumo miden solo al proveedor, no las respuestas del
+        # cache. metered_stream va adentro: consume el CompletionUsage final
+        # para que no cuente como token en las metricas.
+        lambda: timed_stream(
+            provider,
+            model,
+            metered_stream(
+                user_id,
+                provider,
+                model,
+                f"{system_prompt}\n{user_message}",
+                upstream(),
+            ),
+        ),
+        user_id=user_id,
+    )
 
 
 def get_system_prompt(context: str):
@@ -0,0 +1,140 @@
+import asyncio
+import os
+from collections import OrderedDict, deque
+
+from database import database
+from .conversations import conversation_messages_query, messages_after_query
+from ..logger import logger
+
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", 2000))
+CONTEXT_TOKENIZER = os.environ.get("CONTEXT_TOKENIZER", "gpt2")
+CONTEXT_SUMMARIZE = os.environ.get("CONTEXT_SUMMARIZE", "0") == "1"
+CONTEXT_SUMMARY_MODEL = os.environ.get("CONTEXT_SUMMARY_MODEL", "gpt-4o-mini")
+CONTEXT_CACHE_MAX_CONVERSATIONS = 1000
+# Al cargar una conversacion en frio no hace falta leer mas que esto
+COLD_LOAD_MESSAGES = 200
+
+_tokenizer = None
+_tokenizer_failed = False
+
+
+def _load_tokenizer():
+    global _tokenizer, _tokenizer_failed
+    if _tokenizer is not None or _tokenizer_failed:
+        return
+    try:
+        from tokenizers import Tokenizer
+
+        _tokenizer = Tokenizer.from_pretrained(CONTEXT_TOKENIZER)
+    except Exception as e:
+        logger.warning(
+            f"Could not load tokenizer {CONTEXT_TOKENIZER}, estimating tokens: {e}"
+        )
+        _tokenizer_failed = True
+
+
+def count_tokens(lines):
+    """Cantidad de tokens de cada linea. Bloqueante: llamar desde un thread."""
+    _load_tokenizer()
+    if _tokenizer is None:
+        return [len(line) // 4 + 1 for line in lines]
+    return [len(encoding.ids) for encoding in _tokenizer.encode_batch(lines)]
+
+
+class ConversationContext:
+    """
+    Mensajes ya tokenizados de una conversacion. Solo se leen de la base
+    los mensajes nuevos (id > last_id) y cada uno se cuenta una sola vez.
+    Los que ya no entran en el presupuesto se descartan, o se resumen si
+    CONTEXT_SUMMARIZE esta activo.
+    """
+
+    def __init__(self, conversation_id: int):
+        self.conversation_id = conversation_id
+        self.messages = deque()  # (id, line, tokens)
+        self.total_tokens = 0
+        self.last_id = None
+        self.summary = ""
+        self._summarizing = None
+        self._lock = asyncio.Lock()
+
+    async def refresh(self):
+        if self.last_id is None:
+            rows = await database.fetch_all(
+                conversation_messages_query(
+                    self.conversation_id, limit=COLD_LOAD_MESSAGES
+                )
+            )
+            rows = list(reversed(rows))
+            self.last_id = 0
+        else:
+            rows = await database.fetch_all(
+                messages_after_query(self.conversation_id, self.last_id)
+            )
+
+        if not rows:
+            return
+
+        lines = [f"{row['sender']}: {row['text']}" for row in rows]
+        counts = await asyncio.to_thread(count_tokens, lines)
+        for row, line, tokens in zip(rows, lines, counts):
+            self.messages.append((row["id"], line, tokens))
+            self.total_tokens += tokens
+            self.last_id = max(self.last_id, row["id"])
+
+        self._trim()
+
+    def _trim(self):
+        dropped = []
+        while self.messages and self.total_tokens > CONTEXT_TOKEN_BUDGET:
+            _, line, tokens = self.messages.popleft()
+            self.total_tokens -= tokens
+            dropped.append(line)
+
+        if dropped and CONTEXT_SUMMARIZE:
+            self._summarizing = asyncio.create_task(
+                self._summarize(dropped, self._summarizing)
+            )
+
+    async def _summarize(self, dropped_lines, previous_task=None):
+        # Se resume en segundo plano: el turno actual no espera al resumen,
+        # que se usa a partir del siguiente
+        from .completions import create_completion
+
+        if previous_task is not None:
+            await asyncio.gather(previous_task, return_exceptions=True)
+
+        previous = f"Previous summary:\n{self.summary}\n\n" if self.summary else ""
+        try:
+            self.summary = await create_completion(
+                "openai",
+                CONTEXT_SUMMARY_MODEL,
+                "Summarize the conversation in a few sentences, keeping facts, "
+                "names and the user's goals.",
+                previous + "\n".join(dropped_lines),
+            )
+        except Exception as e:
+            logger.error(f"Context summarization failed: {e}")
+
+    def render(self) -> str:
+        lines = [line for _, line, _ in self.messages]
+        if self.summary:
+            lines.insert(0, f"(summary of earlier messages) {self.summary}")
+        return "\n".join(lines)
+
+
+_contexts = OrderedDict()
+
+
+async def build_context(conversation_id: int) -> str:
+    context = _contexts.get(conversation_id)
+    if context is None:
+        context = ConversationContext(conversation_id)
+        _contexts[conversation_id] = context
+        while len(_contexts) > CONTEXT_CACHE_MAX_CONVERSATIONS:
+            _contexts.popitem(last=False)
+    _contexts.move_to_end(conversation_id)
+
+    async with context._lock:
+        await context.refresh()
+        return context.render()
@@ -0,0 +1,147 @@
+import os
+from datetime import datetime
+
+from sqlalchemy import and_, func, or_, select
+
+from database import database, Conversation, Message
+
+# Con "denormalized" el listado lee conversations.message_count y
+# last_message_at en vez de agregar la tabla messages en cada request.
+CONVERSATION_COUNTS = os.environ.get("CONVERSATION_COUNTS", "aggregate")
+
+conversations_table = Conversation.__table__
+messages_table = Message.__table__
+
+
+async def create_conversation(user_id: int) -> int:
+    # databases no aplica los defaults de Python: message_count va explicito
+    return await database.execute(
+        conversations_table.insert().values(user_id=user_id, message_count=0)
+    )
+
+
+async def insert_message(conversation_id: int, sender: str, text: str):
+    timestamp = datetime.utcnow()
+    async with database.transaction():
+        message_id = await database.execute(
+            messages_table.insert().values(
+                conversation_id=conversation_id,
+                sender=sender,
+                text=text,
+                timestamp=timestamp,
+            )
+        )
+        await database.execute(
+            conversations_table.update()
+            .where(conversations_table.c.id == conversation_id)
+            .values(
+                message_count=conversations_table.c.message_count + 1,
+                last_message_at=timestamp,
+            )
+        )
+    return message_id
+
+
+def user_conversations_query(user_id: int, limit: int, before: int = None):
+    """
+    Una sola query para la pagina pedida, ordenada por id descendente.
+    `before` es el cursor: el id de la ultima conversacion de la pagina
+    anterior.
+    """
+    if CONVERSATION_COUNTS == "denormalized":
+        query = select(
+            conversations_table.c.id,
+            conversations_table.c.user_id,
+            conversations_table.c.message_count,
+            conversations_table.c.last_message_at,
+        ).where(conversations_table.c.user_id == user_id)
+    else:
+        query = (
+            select(
+                conversations_table.c.id,
+                conversations_table.c.user_id,
+                func.count(messages_table.c.id).label("message_count"),
+                func.max(messages_table.c.timestamp).label("last_message_at"),
+            )
+            .select_from(
+                conversations_table.outerjoin(
+                    messages_table,
+                    messages_table.c.conversation_id == conversations_table.c.id,
+                )
+            )
+            .where(conversations_table.c.user_id == user_id)
+            .group_by(conversations_table.c.id, conversations_table.c.user_id)
+        )
+
+    if before is not None:
+        query = query.where(conversations_table.c.id < before)
+
+    return query.order_by(conversations_table.c.id.desc()).limit(limit)
+
+
+async def get_user_conversation(conversation_id: int, user_id: int):
+    return await database.fetch_one(
+        select(conversations_table.c.id, conversations_table.c.user_id).where(
+            conversations_table.c.id == conversation_id,
+            conversations_table.c.user_id == user_id,
+        )
+    )
+
+
+def _message_columns():
+    return (
+        messages_table.c.id,
+        messages_table.c.sender,
+        messages_table.c.text,
+        messages_table.c.timestamp,
+    )
+
+
+def conversation_messages_query(conversation_id: int, limit: int, before: int = None):
+    """
+    Ventana de los `limit` mensajes mas recientes anteriores al mensaje
+    `before`, del mas nuevo al mas viejo. Usa el indice
+    (conversation_id, timestamp); el id desempata timestamps iguales.
+    """
+    query = select(*_message_columns()).where(
+        messages_table.c.conversation_id == conversation_id
+    )
+
+    if before is not None:
+        cursor_timestamp = (
+            select(messages_table.c.timestamp)
+            .where(messages_table.c.id == before)
+            .scalar_subquery()
+        )
+        query = query.where(
+            or_(
+                messages_table.c.timestamp < cursor_timestamp,
+                and_(
+                    messages_table.c.timestamp == cursor_timestamp,
+                    messages_table.c.id < before,
+                ),
+            )
+        )
+
+    return query.order_by(
+        messages_table.c.timestamp.desc(), messages_table.c.id.desc()
+    ).limit(limit)
+
+
+def conversation_export_query(conversation_id: int):
+    return (
+        select(*_message_columns())
+        .where(messages_table.c.conversation_id == conversation_id)
+        .order_by(messages_table.c.timestamp, messages_table.c.id)
+    )
+
+
+def messages_after_query(conversation_id: int, after_id: int):
+    return (
+        select(messages_table.c.id, messages_table.c.sender, messages_table.c.text)
+        .where(
+            messages_table.c.conversation_id == conversation_id,
+            messages_table.c.id > after_id,
+        )
+        .order_by(messages_table.c.id)
+    )
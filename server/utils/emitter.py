@@ -0,0 +1,88 @@
+import asyncio
+import os
+
+from .metrics import SOCKET_EMIT_PENDING, SOCKET_EMIT_BATCH
+
+FLUSH_INTERVAL_MS = int(os.environ.get("SOCKET_FLUSH_INTERVAL_MS", 50))
+FLUSH_BYTES = int(os.environ.get("SOCKET_FLUSH_BYTES", 256))
+FIRST_CHUNK_IMMEDIATE = os.environ.get("SOCKET_FIRST_CHUNK_IMMEDIATE", "1") == "1"
+
+
+class CoalescingEmitter:
+    """
+    Agrupa los chunks de una completion y los envia juntos cada
+    `flush_interval_ms` o cuando el buffer llega a `flush_bytes`, lo que
+    ocurra primero. El primer chunk se puede enviar de inmediato para no
+    empeorar el time-to-first-token.
+    """
+
+    def __init__(
+        self,
+        emit,
+        flush_interval_ms: int = FLUSH_INTERVAL_MS,
+        flush_bytes: int = FLUSH_BYTES,
+        first_chunk_immediate: bool = FIRST_CHUNK_IMMEDIATE,
+    ):
+        self._emit = emit
+        self.flush_interval = flush_interval_ms / 1000
+        self.flush_bytes = flush_bytes
+        self.first_chunk_immediate = first_chunk_immediate
+
+        self.parts = []
+        self._buffer = []
+        self._buffer_bytes = 0
+        self._sent_first = False
+        self._timer = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    async def push(self, chunk: str):
+        self.parts.append(chunk)
+        self._buffer.append(chunk)
+        SOCKET_EMIT_PENDING.inc()
+        self._buffer_bytes += len(chunk.encode("utf-8"))
+
+        if not self._sent_first and self.first_chunk_immediate:
+            self._sent_first = True
+            await self.flush()
+        elif self._buffer_bytes >= self.flush_bytes:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        self._timer = None
+        await self.flush()
+
+    async def flush(self):
+        async with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._buffer:
+                return
+            chunk = "".join(self._buffer)
+            SOCKET_EMIT_PENDING.dec(len(self._buffer))
+            SOCKET_EMIT_BATCH.observe(len(self._buffer))
+            self._buffer = []
+            self._buffer_bytes = 0
+            await self._emit(chunk)
+
+    async def close(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        await self.flush()
+
+    def cancel(self):
+        # Descarta lo pendiente sin emitirlo (el cliente ya no lo quiere)
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        SOCKET_EMIT_PENDING.dec(len(self._buffer))
+        self._buffer = []
+        self._buffer_bytes = 0
@@ -0,0 +1,32 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+
+MAX_GENERATIONS_PER_USER = int(os.environ.get("MAX_GENERATIONS_PER_USER", 2))
+
+# key -> [semaforo, cantidad de generaciones usandolo o esperando]
+_slots = {}
+
+
+def is_saturated(key) -> bool:
+    slot = _slots.get(key)
+    return slot is not None and slot[0].locked()
+
+
+@asynccontextmanager
+async def generation_slot(key, limit: int = MAX_GENERATIONS_PER_USER):
+    """
+    Limita las generaciones simultaneas por usuario. Las que pasan el limite
+    esperan su turno en orden de llegada.
+    """
+    slot = _slots.get(key)
+    if slot is None:
+        slot = _slots[key] = [asyncio.Semaphore(limit), 0]
+    slot[1] += 1
+    try:
+        async with slot[0]:
+            yield
+    finally:
+        slot[1] -= 1
+        if slot[1] == 0:
+            _slots.pop(key, None)
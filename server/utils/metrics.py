@@ -0,0 +1,150 @@
+import hmac
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client import multiprocess
+
+# Con varios workers de uvicorn cada proceso escribe sus metricas en este
+# directorio y /metrics las agrega (modo multiproceso de prometheus_client)
+PROMETHEUS_MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+# El modelo llega del cliente: se limita la cantidad de labels distintas
+MAX_MODEL_LABELS = int(os.environ.get("METRICS_MAX_MODEL_LABELS", 50))
+# /metrics solo responde con "Authorization: Bearer <METRICS_TOKEN>"; vacio
+# la deshabilita
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 0.75, 1, 1.5, 2, 3, 5, 8, 13, 20, 30)
+GAP_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2)
+RATE_BUCKETS = (1, 5, 10, 20, 35, 50, 75, 100, 150, 250, 500)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+
+COMPLETION_TTFT = Histogram(
+    "completion_time_to_first_token_seconds",
+    "Tiempo desde el request al proveedor hasta el primer token",
+    ["provider", "model"],
+    buckets=LATENCY_BUCKETS,
+)
+COMPLETION_INTER_TOKEN = Histogram(
+    "completion_inter_token_seconds",
+    "Tiempo entre tokens consecutivos del proveedor",
+    ["provider", "model"],
+    buckets=GAP_BUCKETS,
+)
+COMPLETION_TOKENS_PER_SECOND = Histogram(
+    "completion_tokens_per_second",
+    "Chunks por segundo despues del primer token, por completion",
+    ["provider", "model"],
+    buckets=RATE_BUCKETS,
+)
+SOCKET_FIRST_CHUNK = Histogram(
+    "socket_time_to_first_chunk_seconds",
+    "Desde que llega el mensaje por socket hasta que sale el primer chunk "
+    "(incluye auth, contexto, cache y proveedor)",
+    ["provider", "model"],
+    buckets=LATENCY_BUCKETS,
+)
+UPSTREAM_SECONDS = Histogram(
+    "upstream_request_seconds",
+    "Duracion completa de requests a Whisper y TTS",
+    ["operation"],
+    buckets=LATENCY_BUCKETS,
+)
+SPEECH_FIRST_BYTE = Histogram(
+    "speech_time_to_first_byte_seconds",
+    "Tiempo hasta el primer byte de audio de TTS",
+    buckets=LATENCY_BUCKETS,
+)
+DB_QUERY_SECONDS = Histogram(
+    "db_query_seconds",
+    "Duracion de queries a la base por operacion",
+    ["operation"],
+    buckets=DB_BUCKETS,
+)
+SOCKET_EMIT_PENDING = Gauge(
+    "socket_emit_pending_chunks",
+    "Chunks en buffers de emision esperando ser enviados",
+    multiprocess_mode="livesum",
+)
+SOCKET_EMIT_BATCH = Histogram(
+    "socket_emit_batch_chunks",
+    "Chunks agrupados en cada emit",
+    buckets=(1, 2, 3, 5, 8, 13, 21, 34, 55),
+)
+
+_model_labels = set()
+
+
+def model_label(model) -> str:
+    model = str(model)
+    if model in _model_labels:
+        return model
+    if len(_model_labels) < MAX_MODEL_LABELS:
+        _model_labels.add(model)
+        return model
+    return "other"
+
+
+@contextmanager
+def timed(histogram, **labels):
+    metric = histogram.labels(**labels) if labels else histogram
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metric.observe(time.perf_counter() - started)
+
+
+async def timed_stream(provider: str, model: str, stream):
+    """
+    Envuelve el stream de un proveedor midiendo TTFT, tiempo entre tokens
+    y tokens por segundo. Solo se registran completions que terminan.
+    """
+    labels = {"provider": provider, "model": model_label(model)}
+    inter_token = COMPLETION_INTER_TOKEN.labels(**labels)
+    started = time.perf_counter()
+    first_at = last_at = None
+    chunks = 0
+
+    async for chunk in stream:
+        now = time.perf_counter()
+        if first_at is None:
+            first_at = now
+            COMPLETION_TTFT.labels(**labels).observe(now - started)
+        else:
+            inter_token.observe(now - last_at)
+        last_at = now
+        chunks += 1
+        yield chunk
+
+    if chunks > 1 and last_at > first_at:
+        COMPLETION_TOKENS_PER_SECOND.labels(**labels).observe(
+            (chunks - 1) / (last_at - first_at)
+        )
+
+
+def render_metrics():
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+def metrics_enabled() -> bool:
+    return bool(METRICS_TOKEN)
+
+
+def metrics_authorized(authorization) -> bool:
+    if not METRICS_TOKEN or authorization is None:
+        return False
+    return hmac.compare_digest(
+        authorization.encode(), f"Bearer {METRICS_TOKEN}".encode()
+    )
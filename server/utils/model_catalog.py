@@ -0,0 +1,102 @@
+import asyncio
+import os
+import time
+
+from .ollama_functions import fetch_ollama_models
+from .anthropic_functions import async_anthropic_client
+from ..logger import logger
+
+MODEL_CATALOG_TTL = float(os.environ.get("MODEL_CATALOG_TTL", 60))
+# Tiempo maximo que un request espera al catalogo cuando todavia no hay
+# nada cacheado; despues se responde con lo que haya
+MODEL_CATALOG_FIRST_FETCH_TIMEOUT = 3.0
+
+OPENAI_CHAT_PREFIXES = ("gpt-", "o1", "chatgpt-")
+# La API de Anthropic no lista modelos: catalogo fijo
+ANTHROPIC_MODELS = [
+    "claude-3-5-sonnet-20240620",
+    "claude-3-opus-20240229",
+    "claude-3-haiku-20240307",
+]
+
+
+async def fetch_openai_models():
+    from .openai_functions import async_client
+
+    page = await async_client.models.list()
+    names = sorted(
+        model.id for model in page.data if model.id.startswith(OPENAI_CHAT_PREFIXES)
+    )
+    return [{"name": name, "provider": "openai"} for name in names]
+
+
+async def fetch_ollama_catalog():
+    models = await fetch_ollama_models()
+    return [{**model, "provider": "ollama"} for model in models]
+
+
+async def fetch_anthropic_models():
+    if async_anthropic_client is None:
+        return []
+    return [{"name": name, "provider": "anthropic"} for name in ANTHROPIC_MODELS]
+
+
+class CatalogEntry:
+    """
+    Stale-while-revalidate: mientras hay un valor se devuelve al instante y,
+    si esta vencido, se refresca en segundo plano (uno a la vez).
+    """
+
+    def __init__(self, name, fetch):
+        self.name = name
+        self.fetch = fetch
+        self.models = None
+        self.fetched_at = 0.0
+        self._refreshing = None
+
+    def is_fresh(self):
+        return time.monotonic() - self.fetched_at < MODEL_CATALOG_TTL
+
+    def refresh(self):
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = asyncio.create_task(self._refresh())
+        return self._refreshing
+
+    async def _refresh(self):
+        try:
+            self.models = await self.fetch()
+        except Exception as e:
+            logger.warning(f"Could not list {self.name} models: {e}")
+            if self.models is None:
+                self.models = []
+        # Tambien tras un error: no reintentar en cada request
+        self.fetched_at = time.monotonic()
+
+    async def get(self):
+        if self.models is None:
+            try:
+                await asyncio.wait_for(
+                    asyncio.shield(self.refresh()), MODEL_CATALOG_FIRST_FETCH_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                return []
+        elif not self.is_fresh():
+            self.refresh()
+        return self.models or []
+
+
+CATALOG = [
+    CatalogEntry("openai", fetch_openai_models),
+    CatalogEntry("ollama", fetch_ollama_catalog),
+    CatalogEntry("anthropic", fetch_anthropic_models),
+]
+
+
+async def list_models():
+    results = await asyncio.gather(*(entry.get() for entry in CATALOG))
+    return [model for models in results for model in models]
+
+
+def warm_model_catalog():
+    for entry in CATALOG:
+        entry.refresh()
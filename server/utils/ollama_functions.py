@@ -1,32 +1,50 @@
-from openai import OpenAI
-import requests
+import os
+import httpx
+from openai import AsyncOpenAI
 
+OLLAMA_BASE_URL = os.environ.get("OLLAMA_BASE_URL", "http://localhost:11434")
 
-def create_completion_ollama(system_prompt, user_message, model="llama3.1"):
-    client = OpenAI(base_url="http://localhost:11434/v1", api_key="llama3")
-    response = client.chat.completions.create(
+# Cliente creado una sola vez: reutiliza las conexiones keep-alive con Ollama
+ollama_client = AsyncOpenAI(
+    base_url=f"{OLLAMA_BASE_URL}/v1",
+    api_key="llama3",
+    http_client=httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+        timeout=httpx.Timeout(120.0, connect=5.0),
+    ),
+)
+
+# Cliente corto para el catalogo: si Ollama no responde se falla rapido en
+# vez de colgar el worker
+ollama_http_client = httpx.AsyncClient(
+    base_url=OLLAMA_BASE_URL, timeout=httpx.Timeout(3.0, connect=1.0)
+)
+
+
+async def close_ollama_client():
+    await ollama_client.close()
+    await ollama_http_client.aclose()
+
+
+async def stream_completion_ollama(system_prompt, user_message, model="llama3.1"):
+    response = await ollama_client.chat.completions.create(
         model=model,
         messages=[
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_message},
         ],
         max_tokens=1000,
+        stream=True,
     )
-    return response.choices[0].message.content
-
-
-def list_ollama_models():
-    url = "http://localhost:11434/api/tags"
-    response = requests.get(url)
-
-    if response.status_code == 200:
-        models = response.json().get("models", [])
-        return models
-    else:
-        return []
+    try:
+        async for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        await response.close()
 
 
-if __name__ == "__main__":
-    models = list_ollama_models()
-    print(models)
-    # answer = create_completion_ollama("hello worl")
+async def fetch_ollama_models():
+    response = await ollama_http_client.get("/api/tags")
+    response.raise_for_status()
+    return response.json().get("models", [])
@@ -1,8 +1,12 @@
 import os
-from openai import OpenAI
+import time
+from pathlib import Path
+import httpx
+from openai import AsyncOpenAI
 from dotenv import load_dotenv
-import requests
-from ..logger import logger
+from ..logger import logger, debug_sampled
+from .metrics import timed, UPSTREAM_SECONDS, SPEECH_FIRST_BYTE
+from .usage import CompletionUsage
 
 # from pydub import AudioSegment
 
@@ -10,68 +14,49 @@ load_dotenv()
 
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 
-client = OpenAI(
-    api_key=os.environ.get("OPENAI_API_KEY"),
+# Un solo pool de conexiones HTTP compartido por todas las completions en streaming,
+# asi no se repite el handshake TLS en cada request ni se bloquea el event loop.
+OPENAI_MAX_CONNECTIONS = int(os.environ.get("OPENAI_MAX_CONNECTIONS", 100))
+OPENAI_MAX_KEEPALIVE = int(os.environ.get("OPENAI_MAX_KEEPALIVE", 20))
+
+async_http_client = httpx.AsyncClient(
+    limits=httpx.Limits(
+        max_connections=OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+    ),
+    timeout=httpx.Timeout(60.0, connect=10.0),
 )
 
+async_client = AsyncOpenAI(
+    api_key=os.environ.get("OPENAI_API_KEY"),
+    http_client=async_http_client,
+)
 
-def transcribe_audio(audio_file, output_format="verbose_json") -> str:
-    transcription = client.audio.transcriptions.create(
-        response_format=output_format, model="whisper-1", file=audio_file
-    )
-
-    if output_format == "vtt":
-        return transcription
-    return transcription.text
 
+async def close_async_clients():
+    await async_client.close()
 
-def create_completion_openai(
-    system_prompt: str, user_message: str, model="gpt-4o-mini"
-):
-    completion = client.chat.completions.create(
-        model=model,
-        max_tokens=500,
-        messages=[
-            {
-                "role": "system",
-                "content": system_prompt,
-            },
-            {"role": "user", "content": user_message},
-        ],
-    )
-    return completion.choices[0].message.content
 
+async def _create_transcription(audio_path, output_format, openai_client=None):
+    # El cliente async lee el archivo y espera a Whisper sin bloquear el event loop
+    openai_client = openai_client or async_client
+    with timed(UPSTREAM_SECONDS, operation="transcription"):
+        return await openai_client.audio.transcriptions.create(
+            response_format=output_format, model="whisper-1", file=Path(audio_path)
+        )
 
-import asyncio
 
-async def create_streaming_completion(
-    system_prompt: str, user_message: str, model="gpt-4o-mini"
-):
-    response = client.chat.completions.create(
-        model=model,
-        max_tokens=500,
-        stream=True,
-        messages=[
-            {
-                "role": "system",
-                "content": system_prompt,
-            },
-            {"role": "user", "content": user_message},
-        ],
+async def async_transcribe_audio_with_duration(audio_path, openai_client=None):
+    """Texto y duracion del audio en segundos (None si no viene)."""
+    transcription = await _create_transcription(
+        audio_path, "verbose_json", openai_client
     )
-    for chunk in response:
-        content = chunk.choices[0].delta.content
-
-        print(chunk)
-        logger.debug(chunk.choices[0])
-        if isinstance(content, str):
-            yield content
-        else:
-            logger.debug(f"The content is not a string is: {content}")
+    return transcription.text, getattr(transcription, "duration", None)
 
 
-
-async def stream_completion(prompt, user_message, model="gpt-4o-mini", imageB64=""):
+async def stream_completion(
+    prompt, user_message, model="gpt-4o-mini", imageB64="", openai_client=None
+):
     logger.debug(f"MODEL TO COMPLETE: {model}")
     content = user_message
 
@@ -95,7 +80,9 @@ async def stream_completion(prompt, user_message, model="gpt-4o-mini", imageB64=
     if model == "gpt-4o-mini":
         max_tokens = 10000
 
-    response = client.chat.completions.create(
+    # Sin cliente propio (clave de la organizacion) se usa el del entorno
+    openai_client = openai_client or async_client
+    response = await openai_client.chat.completions.create(
         model=model,
         max_tokens=max_tokens,
         messages=[
@@ -104,79 +91,79 @@ async def stream_completion(prompt, user_message, model="gpt-4o-mini", imageB64=
         ],
         temperature=0.5,
         stream=True,
+        # El ultimo chunk trae los tokens que se van a cobrar
+        stream_options={"include_usage": True},
     )
 
-    for chunk in response:
-        if chunk.choices[0].delta.content:
-            yield chunk.choices[0].delta.content
+    # El siguiente chunk solo se lee del upstream cuando el consumidor
+    # (sio.emit o StreamingResponse) termino de enviar el anterior: eso es
+    # el backpressure. Si el consumidor abandona el generador, se cierra la
+    # conexion para dejar de pagar tokens.
+    try:
+        async for chunk in response:
+            debug_sampled("Completion chunk: %s", chunk)
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+            if chunk.usage is not None:
+                yield CompletionUsage(
+                    chunk.usage.prompt_tokens, chunk.usage.completion_tokens
+                )
+    finally:
+        await response.close()
+
+
+SPEECH_CHUNK_SIZE = 16 * 1024
 
+SPEECH_MEDIA_TYPES = {
+    "mp3": "audio/mpeg",
+    "opus": "audio/ogg",
+    "aac": "audio/aac",
+    "flac": "audio/flac",
+    "wav": "audio/wav",
+    "pcm": "audio/pcm",
+}
 
+SPEECH_VOICES = {"alloy", "echo", "fable", "onyx", "nova", "shimmer"}
 
-async def async_create_streaming_completion(*args, **kwargs):
-    loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(None, create_streaming_completion, *args, **kwargs)
 
 async def generate_speech_stream(
     text: str,
-    output_path: str,
     model: str = "tts-1",
     voice: str = "alloy",
     output_format: str = "mp3",
+    chunk_size: int = SPEECH_CHUNK_SIZE,
+    openai_client=None,
 ):
-    try:
-        with open(output_path, "wb") as output_file:
-            response = client.audio.speech.create(model=model, voice=voice, input=text)
-            response.stream_to_file(output_file.name)
-    except Exception as e:
-        print(f"An unexpected error occurred: {e}")
-
-
-def generate_speech_api(
-    text: str, model: str = "tts-1-1106", voice: str = "onyx"
-) -> bytes:
-    try:
-        response = requests.post(
-            "https://api.openai.com/v1/audio/speech",
-            headers={
-                "Authorization": f"Bearer {os.environ['OPENAI_API_KEY']}",
-            },
-            json={
-                "model": model,
-                "input": text,
-                "voice": voice,
-            },
-        )
-
-        response.raise_for_status()  # Raise an error for bad status codes
-
-        audio = b""
-        for chunk in response.iter_content(chunk_size=1024 * 1024):
-            audio += chunk
-
-        return audio
-
-    except requests.exceptions.RequestException as e:
-        print(f"An error occurred: {e}")
-        return b""
-
-
-def generate_image(
+    # Cada request tiene su propio stream: los bytes se reenvian a medida que
+    # llegan del proveedor, sin pasar por un archivo compartido
+    started = time.perf_counter()
+    first_byte = True
+    openai_client = openai_client or async_client
+    async with openai_client.audio.speech.with_streaming_response.create(
+        model=model, voice=voice, input=text, response_format=output_format
+    ) as response:
+        async for chunk in response.iter_bytes(chunk_size):
+            if first_byte:
+                first_byte = False
+                SPEECH_FIRST_BYTE.observe(time.perf_counter() - started)
+            yield chunk
+    UPSTREAM_SECONDS.labels(operation="speech").observe(time.perf_counter() - started)
+
+
+async def async_generate_image(
     prompt: str,
     model: str = "dall-e-3",
     size: str = "1024x1024",
     quality: str = "standard",
     n: int = 1,
+    openai_client=None,
 ) -> str:
-    try:
-        response = client.images.generate(
-            model=model,
-            prompt=prompt,
-            size=size,
-            quality=quality,
-            n=n,
-        )
-        image_url = response.data[0].url
-        return image_url
-    except Exception as e:
-        print(e)
-        return f"Error generating image: {e}"
+    openai_client = openai_client or async_client
+    response = await openai_client.images.generate(
+        model=model,
+        prompt=prompt,
+        size=size,
+        quality=quality,
+        n=n,
+    )
+    return response.data[0].url
@@ -0,0 +1,108 @@
+import os
+import time
+from collections import OrderedDict
+
+from openai import AsyncOpenAI
+from sqlalchemy import select
+
+from database import database, Organization, OrganizationConfig
+from . import openai_functions
+
+# Cuanto se confia en la clave cacheada de un usuario; al cambiar la
+# configuracion se invalida al momento en todos los workers (con
+# SOCKETIO_MESSAGE_QUEUE), si no en los otros se toma la nueva al vencer
+ORG_KEY_CACHE_TTL = float(os.environ.get("ORG_KEY_CACHE_TTL", 300))
+ORG_KEY_CACHE_MAX_ENTRIES = int(os.environ.get("ORG_KEY_CACHE_MAX_ENTRIES", 10000))
+ORG_CLIENTS_MAX = int(os.environ.get("ORG_CLIENTS_MAX", 256))
+
+# user_id -> (organization_id o None, api_key o None, monotonic hasta el que vale)
+_keys = OrderedDict()
+# api_key -> AsyncOpenAI, el menos usado al principio
+_clients = OrderedDict()
+
+
+def _cached_key(user_id):
+    entry = _keys.get(user_id)
+    if entry is None:
+        return False, None
+    _, api_key, valid_until = entry
+    if valid_until <= time.monotonic():
+        _keys.pop(user_id, None)
+        return False, None
+    _keys.move_to_end(user_id)
+    return True, api_key
+
+
+async def _load_key(user_id):
+    """(organization_id, api_key) de la primera organizacion del usuario."""
+    query = (
+        select(Organization.id, OrganizationConfig.OPENAI_API_KEY)
+        .select_from(
+            Organization.__table__.outerjoin(
+                OrganizationConfig.__table__,
+                OrganizationConfig.organization_id == Organization.id,
+            )
+        )
+        .where(Organization.owner_id == user_id)
+        .order_by(Organization.id, OrganizationConfig.id.desc())
+        .limit(1)
+    )
+    row = await database.fetch_one(query)
+    if row is None:
+        return None, None
+    return row[0], row[1] or None
+
+
+def client_for_key(api_key: str) -> AsyncOpenAI:
+    """
+    Un cliente por clave, reutilizado entre requests. Todos comparten el
+    pool de conexiones de openai_functions: la clave va en el header de
+    cada request, asi que no hace falta un pool por organizacion.
+    """
+    client = _clients.get(api_key)
+    if client is not None:
+        _clients.move_to_end(api_key)
+        return client
+
+    client = AsyncOpenAI(
+        api_key=api_key, http_client=openai_functions.async_http_client
+    )
+    _clients[api_key] = client
+    while len(_clients) > ORG_CLIENTS_MAX:
+        # No se cierra: cerrar el cliente cerraria el pool compartido
+        _clients.popitem(last=False)
+    return client
+
+
+async def openai_client_for(user_id):
+    """
+    Cliente de OpenAI con la clave de la organizacion del usuario, o el
+    cliente del entorno si no tiene organizacion o configuracion.
+    """
+    if user_id is None:
+        return openai_functions.async_client
+
+    hit, api_key = _cached_key(user_id)
+    if not hit:
+        organization_id, api_key = await _load_key(user_id)
+        _keys[user_id] = (
+            organization_id,
+            api_key,
+            time.monotonic() + ORG_KEY_CACHE_TTL,
+        )
+        _keys.move_to_end(user_id)
+        while len(_keys) > ORG_KEY_CACHE_MAX_ENTRIES:
+            _keys.popitem(last=False)
+
+    if api_key is None:
+        return openai_functions.async_client
+    return client_for_key(api_key)
+
+
+def invalidate_organization(organization_id, owner_id=None):
+    # Llamar al cambiar la configuracion de una organizacion
+    for user_id, entry in list(_keys.items()):
+        if user_id == owner_id or entry[0] == organization_id:
+            _keys.pop(user_id, None)
+            if entry[1] is not None:
+                _clients.pop(entry[1], None)
@@ -0,0 +1,47 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from passlib.context import CryptContext
+
+# argon2-cffi suelta el GIL mientras calcula el hash, asi que un pool de
+# threads acotado alcanza para sacar el trabajo del event loop
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", 2))
+ARGON2_TIME_COST = int(os.environ.get("ARGON2_TIME_COST", 3))
+ARGON2_MEMORY_COST = int(os.environ.get("ARGON2_MEMORY_COST", 65536))  # KiB
+ARGON2_PARALLELISM = int(os.environ.get("ARGON2_PARALLELISM", 4))
+
+# Cambiar bcrypt por argon2. Los valores por defecto son los de argon2-cffi,
+# los mismos con los que se hicieron los hashes existentes. Con
+# deprecated="auto" los hashes con otros parametros se rehacen al hacer login.
+pwd_context = CryptContext(
+    schemes=["argon2"],
+    deprecated="auto",
+    argon2__time_cost=ARGON2_TIME_COST,
+    argon2__memory_cost=ARGON2_MEMORY_COST,
+    argon2__parallelism=ARGON2_PARALLELISM,
+)
+
+_executor = ThreadPoolExecutor(
+    max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash"
+)
+
+
+async def hash_password(password: str) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, pwd_context.hash, password)
+
+
+async def verify_and_update_password(password: str, password_hash: str):
+    """
+    Devuelve (valido, nuevo_hash). nuevo_hash no es None cuando el hash
+    guardado usa parametros viejos y hay que reemplazarlo.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _executor, pwd_context.verify_and_update, password, password_hash
+    )
+
+
+def shutdown_password_executor():
+    _executor.shutdown(wait=False, cancel_futures=True)
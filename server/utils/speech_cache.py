@@ -0,0 +1,129 @@
+import asyncio
+import hashlib
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+from .openai_functions import generate_speech_stream
+from .usage import record_usage
+from .org_clients import openai_client_for
+
+SPEECH_CACHE_DIR = os.path.join("audios", "speech_cache")
+SPEECH_CACHE_MAX_BYTES = int(
+    os.environ.get("SPEECH_CACHE_MAX_BYTES", 512 * 1024 * 1024)
+)
+
+# Indice en memoria: key -> (path, size), el menos usado al principio.
+# Los archivos en disco son la fuente de verdad; el indice se arma al
+# primer uso a partir de su mtime.
+_index = None
+_total_bytes = 0
+_lock = threading.Lock()
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(text.split())
+
+
+def speech_cache_key(text: str, voice: str, model: str, output_format: str) -> str:
+    raw = "\0".join([model, voice, output_format, normalize_text(text)])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _load_index():
+    global _index, _total_bytes
+    os.makedirs(SPEECH_CACHE_DIR, exist_ok=True)
+    entries = []
+    for entry in os.scandir(SPEECH_CACHE_DIR):
+        if entry.is_file() and not entry.name.startswith("."):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, entry.name.split(".")[0], entry.path, stat.st_size))
+
+    _index = OrderedDict()
+    _total_bytes = 0
+    for _, key, path, size in sorted(entries):
+        _index[key] = (path, size)
+        _total_bytes += size
+
+
+def lookup(key: str):
+    with _lock:
+        if _index is None:
+            _load_index()
+        entry = _index.get(key)
+        if entry is None:
+            return None
+        _index.move_to_end(key)
+        return entry[0]
+
+
+def store(key: str, output_format: str, audio: bytes):
+    """Guarda el audio en disco y aplica el limite de tamaño. Bloqueante."""
+    global _total_bytes
+    if not audio:
+        return None
+
+    os.makedirs(SPEECH_CACHE_DIR, exist_ok=True)
+    path = os.path.join(SPEECH_CACHE_DIR, f"{key}.{output_format}")
+    tmp_path = os.path.join(SPEECH_CACHE_DIR, f".tmp-{uuid.uuid4()}")
+    with open(tmp_path, "wb") as tmp_file:
+        tmp_file.write(audio)
+    os.replace(tmp_path, path)
+
+    with _lock:
+        if _index is None:
+            _load_index()
+        previous = _index.pop(key, None)
+        if previous is not None:
+            _total_bytes -= previous[1]
+        _index[key] = (path, len(audio))
+        _total_bytes += len(audio)
+
+        while _total_bytes > SPEECH_CACHE_MAX_BYTES and len(_index) > 1:
+            _, (old_path, old_size) = _index.popitem(last=False)
+            try:
+                os.remove(old_path)
+            except FileNotFoundError:
+                pass
+            _total_bytes -= old_size
+
+    return path
+
+
+async def synthesize_cached(
+    text: str,
+    model: str = "tts-1",
+    voice: str = "alloy",
+    output_format: str = "mp3",
+    user_id: int = None,
+) -> bytes:
+    key = speech_cache_key(text, voice, model, output_format)
+    path = lookup(key)
+    if path is not None:
+        try:
+            return await asyncio.to_thread(_read_file, path)
+        except FileNotFoundError:
+            pass
+
+    openai_client = await openai_client_for(user_id)
+    chunks = [
+        chunk
+        async for chunk in generate_speech_stream(
+            text,
+            model=model,
+            voice=voice,
+            output_format=output_format,
+            openai_client=openai_client,
+        )
+    ]
+    audio = b"".join(chunks)
+    # Solo se cobra lo que se pidio al proveedor, no los hits del cache
+    record_usage(user_id, "speech", "openai", model, len(text))
+    await asyncio.to_thread(store, key, output_format, audio)
+    return audio
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as audio_file:
+        return audio_file.read()
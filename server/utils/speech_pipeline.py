@@ -0,0 +1,116 @@
+import asyncio
+import os
+import re
+
+from .speech_cache import synthesize_cached
+from ..logger import logger
+
+SPEECH_CONCURRENCY = int(os.environ.get("SPEECH_CONCURRENCY", 3))
+MIN_SENTENCE_LENGTH = 20
+
+SENTENCE_END = re.compile(r"(?<=[.!?…:;])\s+|\n+")
+
+
+def split_sentences(text: str):
+    """
+    Separa las oraciones completas del texto. Devuelve (oraciones, resto),
+    donde el resto es el fragmento que todavia no termino.
+    """
+    parts = SENTENCE_END.split(text)
+    rest = parts.pop()
+    return [part.strip() for part in parts if part.strip()], rest
+
+
+class SentenceSpeaker:
+    """
+    Recibe los chunks de texto de una completion, corta en oraciones y
+    sintetiza cada una en paralelo (hasta `max_concurrency` a la vez).
+    El audio se emite en el orden de las oraciones aunque terminen
+    desordenadas.
+    """
+
+    def __init__(
+        self,
+        emit_audio,
+        voice: str = "alloy",
+        model: str = "tts-1",
+        output_format: str = "mp3",
+        max_concurrency: int = SPEECH_CONCURRENCY,
+        user_id: int = None,
+    ):
+        self._emit_audio = emit_audio
+        self.user_id = user_id
+        self.voice = voice
+        self.model = model
+        self.output_format = output_format
+
+        self._buffer = ""
+        self._pending = ""
+        self._index = 0
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._ordered = asyncio.Queue()
+        self._sender = asyncio.create_task(self._send_in_order())
+
+    def feed(self, chunk: str):
+        self._buffer += chunk
+        sentences, self._buffer = split_sentences(self._buffer)
+        for sentence in sentences:
+            self._add_sentence(sentence)
+
+    def _add_sentence(self, sentence: str, force: bool = False):
+        # Las oraciones muy cortas se juntan con la siguiente para no pagar
+        # un round trip de TTS por un "Ok."
+        text = f"{self._pending} {sentence}".strip()
+        if len(text) < MIN_SENTENCE_LENGTH and not force:
+            self._pending = text
+            return
+        self._pending = ""
+        if not text:
+            return
+
+        task = asyncio.create_task(self._synthesize(text))
+        self._ordered.put_nowait((self._index, text, task))
+        self._index += 1
+
+    async def _synthesize(self, text: str) -> bytes:
+        async with self._semaphore:
+            return await synthesize_cached(
+                text,
+                model=self.model,
+                voice=self.voice,
+                output_format=self.output_format,
+                user_id=self.user_id,
+            )
+
+    async def _send_in_order(self):
+        while True:
+            item = await self._ordered.get()
+            if item is None:
+                return
+            index, text, task = item
+            try:
+                audio = await task
+            except Exception as e:
+                logger.error(f"Speech synthesis failed for sentence {index}: {e}")
+                continue
+            await self._emit_audio(
+                {
+                    "index": index,
+                    "sentence": text,
+                    "format": self.output_format,
+                    "audio": audio,
+                }
+            )
+
+    async def close(self):
+        self._add_sentence(self._buffer.strip(), force=True)
+        self._buffer = ""
+        self._ordered.put_nowait(None)
+        await self._sender
+
+    def cancel(self):
+        self._sender.cancel()
+        while not self._ordered.empty():
+            item = self._ordered.get_nowait()
+            if item is not None:
+                item[2].cancel()
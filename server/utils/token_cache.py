@@ -0,0 +1,85 @@
+import os
+import time
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+
+from database import database, Token
+from .metrics import timed, DB_QUERY_SECONDS
+
+AUTH_CACHE_TTL = float(os.environ.get("AUTH_CACHE_TTL", 300))
+AUTH_NEGATIVE_CACHE_TTL = float(os.environ.get("AUTH_NEGATIVE_CACHE_TTL", 30))
+AUTH_CACHE_MAX_ENTRIES = int(os.environ.get("AUTH_CACHE_MAX_ENTRIES", 10000))
+
+CachedToken = namedtuple(
+    "CachedToken", ["id", "user_id", "token", "is_permanent", "expiration_date"]
+)
+
+# token -> (CachedToken o None si no existe, monotonic hasta el que vale)
+_cache = OrderedDict()
+
+
+def is_expired(token: CachedToken) -> bool:
+    return (
+        not token.is_permanent
+        and token.expiration_date is not None
+        and token.expiration_date <= datetime.utcnow()
+    )
+
+
+def get(token_str: str):
+    """
+    Devuelve (hit, token). Un hit con token None es un token que ya se sabe
+    que no existe (cache negativo).
+    """
+    entry = _cache.get(token_str)
+    if entry is None:
+        return False, None
+
+    token, valid_until = entry
+    if valid_until <= time.monotonic():
+        _cache.pop(token_str, None)
+        return False, None
+
+    _cache.move_to_end(token_str)
+    return True, token
+
+
+def put(token_str: str, token):
+    ttl = AUTH_CACHE_TTL if token is not None else AUTH_NEGATIVE_CACHE_TTL
+    if token is not None and token.expiration_date is not None:
+        # Nunca cachear un token mas alla de su expiracion
+        remaining = (token.expiration_date - datetime.utcnow()).total_seconds()
+        ttl = max(0, min(ttl, remaining))
+
+    _cache[token_str] = (token, time.monotonic() + ttl)
+    _cache.move_to_end(token_str)
+    while len(_cache) > AUTH_CACHE_MAX_ENTRIES:
+        _cache.popitem(last=False)
+
+
+def invalidate(token_str: str):
+    _cache.pop(token_str, None)
+
+
+
+async def resolve_token(token_str: str):
+    """Token del cache o de la base (async). None si no existe."""
+    hit, token = get(token_str)
+    if hit:
+        return token
+
+    with timed(DB_QUERY_SECONDS, operation="verify_token"):
+        row = await database.fetch_one(
+            Token.__table__.select().where(Token.token == token_str)
+        )
+    token = None
+    if row is not None:
+        token = CachedToken(
+            id=row["id"],
+            user_id=row["user_id"],
+            token=row["token"],
+            is_permanent=row["is_permanent"],
+            expiration_date=row["expiration_date"],
+        )
+    put(token_str, token)
+    return token
@@ -0,0 +1,190 @@
+import asyncio
+import os
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+
+from database import database, Audio
+from .openai_functions import async_transcribe_audio_with_duration
+from .usage import record_usage
+from .org_clients import openai_client_for
+from ..logger import logger
+
+TRANSCRIPTION_WORKERS = int(os.environ.get("TRANSCRIPTION_WORKERS", 4))
+TRANSCRIPTION_QUEUE_SIZE = int(os.environ.get("TRANSCRIPTION_QUEUE_SIZE", 100))
+MAX_STORED_JOBS = 1000
+
+# Estado en memoria de los trabajos: job_id -> dict con status y resultado.
+# Los trabajos terminados mas viejos se descartan al pasar MAX_STORED_JOBS.
+jobs = OrderedDict()
+# content_hash -> job pendiente, para no transcribir dos veces el mismo audio
+# si llega repetido mientras el primero sigue en la cola
+in_flight = {}
+
+_queue = None
+_workers = []
+
+
+def _new_job(
+    filename: str,
+    audio_path: str,
+    socket_id: str = None,
+    content_hash: str = None,
+    user_id: int = None,
+):
+    job_id = str(uuid.uuid4())
+    jobs[job_id] = {
+        "id": job_id,
+        "status": "pending",
+        "filename": filename,
+        "audio_path": audio_path,
+        "content_hash": content_hash,
+        "file_size": os.path.getsize(audio_path),
+        # Quien subio el audio primero: con su clave se llama a la API
+        "user_id": user_id,
+        # (socket_id, user_id) de cada subida que espera este resultado,
+        # incluidas las repetidas que llegan mientras esta en la cola
+        "waiters": [(socket_id, user_id)],
+        "transcription": None,
+        "error": None,
+        "created_at": datetime.utcnow(),
+        "done": asyncio.Event(),
+    }
+
+    while len(jobs) > MAX_STORED_JOBS:
+        oldest_id, oldest = next(iter(jobs.items()))
+        if not oldest["done"].is_set():
+            break
+        jobs.pop(oldest_id)
+
+    return jobs[job_id]
+
+
+def serialize_job(job: dict):
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "file_size": job["file_size"],
+        "transcription": job["transcription"],
+        "error": job["error"],
+    }
+
+
+def get_job(job_id: str):
+    return jobs.get(job_id)
+
+
+def job_user_ids(job: dict):
+    return {user_id for _, user_id in job["waiters"] if user_id is not None}
+
+
+def in_flight_hashes():
+    return set(in_flight)
+
+
+async def enqueue_transcription(
+    filename: str,
+    audio_path: str,
+    socket_id: str = None,
+    content_hash: str = None,
+    user_id: int = None,
+):
+    if _queue is None:
+        raise RuntimeError("Transcription workers are not running")
+
+    if content_hash is not None and content_hash in in_flight:
+        job = in_flight[content_hash]
+        job["waiters"].append((socket_id, user_id))
+        return job
+
+    job = _new_job(filename, audio_path, socket_id, content_hash, user_id)
+    # put_nowait: si la cola esta llena se rechaza la subida en vez de
+    # acumular trabajos sin limite
+    try:
+        _queue.put_nowait(job["id"])
+    except asyncio.QueueFull:
+        jobs.pop(job["id"])
+        raise
+
+    if content_hash is not None:
+        in_flight[content_hash] = job
+    return job
+
+
+async def _notify(job: dict):
+    socket_ids = {socket_id for socket_id, _ in job["waiters"] if socket_id}
+    if not socket_ids:
+        return
+    from server.socket import sio
+
+    payload = serialize_job(job)
+    for socket_id in socket_ids:
+        await sio.emit("transcriptionFinished", payload, to=socket_id)
+
+
+def _record_transcription_usage(job: dict, duration: float):
+    # La API se llama una sola vez: los segundos se reparten entre los
+    # usuarios que subieron el mismo audio
+    user_ids = job_user_ids(job)
+    for user_id in user_ids:
+        record_usage(
+            user_id, "transcription", "openai", "whisper-1", duration / len(user_ids)
+        )
+
+
+async def _process(job: dict):
+    job["status"] = "processing"
+    try:
+        openai_client = await openai_client_for(job["user_id"])
+        transcription, duration = await async_transcribe_audio_with_duration(
+            job["audio_path"], openai_client
+        )
+        if duration is not None:
+            _record_transcription_usage(job, duration)
+
+        async with database.transaction():
+            query = Audio.__table__.insert().values(
+                filename=job["filename"],
+                content_hash=job["content_hash"],
+                transcription=transcription,
+            )
+            await database.execute(query)
+
+        job["transcription"] = transcription
+        job["status"] = "done"
+    except Exception as e:
+        logger.error(f"Transcription job {job['id']} failed: {e}")
+        job["error"] = str(e)
+        job["status"] = "error"
+    finally:
+        in_flight.pop(job["content_hash"], None)
+        job["done"].set()
+
+    await _notify(job)
+
+
+async def _worker():
+    while True:
+        job_id = await _queue.get()
+        try:
+            job = jobs.get(job_id)
+            if job is not None:
+                await _process(job)
+        finally:
+            _queue.task_done()
+
+
+async def start_transcription_workers(workers: int = TRANSCRIPTION_WORKERS):
+    global _queue
+    _queue = asyncio.Queue(maxsize=TRANSCRIPTION_QUEUE_SIZE)
+    for _ in range(workers):
+        _workers.append(asyncio.create_task(_worker()))
+
+
+async def stop_transcription_workers():
+    global _queue
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+    _queue = None
@@ -0,0 +1,375 @@
+import asyncio
+import os
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy.dialects import postgresql, sqlite
+
+from database import (
+    database,
+    IS_SQLITE,
+    Organization,
+    ConsumptionPeriod,
+    ConsumptionItem,
+)
+from .context_window import count_tokens
+from ..logger import logger
+
+USAGE_FLUSH_INTERVAL = float(os.environ.get("USAGE_FLUSH_INTERVAL", 10))
+# Con esta cantidad de eventos pendientes se adelanta el flush
+USAGE_FLUSH_MAX_EVENTS = int(os.environ.get("USAGE_FLUSH_MAX_EVENTS", 500))
+# Si la base no responde se guardan hasta este limite para reintentar
+USAGE_BUFFER_MAX_EVENTS = int(os.environ.get("USAGE_BUFFER_MAX_EVENTS", 100000))
+
+# Precios en USD. Los modelos se buscan por prefijo (gpt-4o-mini-2024-07-18
+# usa el precio de gpt-4o-mini); lo que no esta usa el precio "default".
+# Completions: (entrada, salida) por millon de tokens
+COMPLETION_PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4-turbo": (10.00, 30.00),
+    "gpt-4": (30.00, 60.00),
+    "o1-mini": (3.00, 12.00),
+    "o1": (15.00, 60.00),
+    "claude-3-5-sonnet": (3.00, 15.00),
+    "claude-3-opus": (15.00, 75.00),
+    "claude-3-haiku": (0.25, 1.25),
+    "default": (0.15, 0.60),
+}
+# Los modelos de Ollama corren en infraestructura propia
+FREE_PROVIDERS = {"ollama"}
+# Por minuto de audio
+TRANSCRIPTION_PRICES = {"whisper-1": 0.006, "default": 0.006}
+# Por millon de caracteres
+SPEECH_PRICES = {"tts-1-hd": 30.00, "tts-1": 15.00, "default": 15.00}
+# Por imagen
+IMAGE_PRICES = {"dall-e-3": 0.04, "dall-e-2": 0.02, "default": 0.04}
+# Por millon de tokens
+EMBEDDING_PRICES = {
+    "text-embedding-3-small": 0.02,
+    "text-embedding-3-large": 0.13,
+    "default": 0.02,
+}
+
+UsageEvent = namedtuple(
+    "UsageEvent",
+    [
+        "user_id",
+        "kind",
+        "provider",
+        "model",
+        "quantity",
+        "prompt",
+        "completion",
+        "input_tokens",
+        "output_tokens",
+    ],
+)
+
+# Tokens que informa el proveedor al final del stream. Los streams de los
+# proveedores lo entregan como ultimo elemento; metered_stream lo consume y
+# no llega al cliente.
+CompletionUsage = namedtuple("CompletionUsage", ["input_tokens", "output_tokens"])
+
+_events = []
+_flush_requested = None
+_flusher = None
+_flush_lock = asyncio.Lock()
+
+
+def price_for(prices: dict, model: str):
+    matches = [name for name in prices if model and model.startswith(name)]
+    if not matches:
+        return prices["default"]
+    return prices[max(matches, key=len)]
+
+
+def record_usage(
+    user_id,
+    kind: str,
+    provider: str,
+    model: str,
+    quantity: float = 0,
+    prompt: str = None,
+    completion: str = None,
+    input_tokens: int = None,
+    output_tokens: int = None,
+):
+    """
+    Registra un evento de consumo en memoria; se escribe a la base en el
+    proximo flush. kind: completion (tokens informados por el proveedor, o
+    estimados a partir de prompt/completion al hacer flush), transcription
+    (segundos), speech (caracteres), image (imagenes) o embedding (tokens).
+    """
+    if user_id is None:
+        return
+    _events.append(
+        UsageEvent(
+            user_id,
+            kind,
+            provider,
+            model,
+            quantity,
+            prompt,
+            completion,
+            input_tokens,
+            output_tokens,
+        )
+    )
+    if len(_events) > USAGE_BUFFER_MAX_EVENTS:
+        dropped = len(_events) - USAGE_BUFFER_MAX_EVENTS
+        del _events[:dropped]
+        logger.error(f"Usage buffer full, dropped {dropped} events")
+    if len(_events) >= USAGE_FLUSH_MAX_EVENTS and _flush_requested is not None:
+        _flush_requested.set()
+
+
+def _is_estimated(event) -> bool:
+    return event.kind == "completion" and event.input_tokens is None
+
+
+def _count_completion_tokens(events):
+    """
+    (tokens de entrada, tokens de salida) estimados de las completions sin
+    usage del proveedor. Bloqueante.
+    """
+    completions = [event for event in events if _is_estimated(event)]
+    lines = []
+    for event in completions:
+        lines.append(event.prompt or "")
+        lines.append(event.completion or "")
+    counts = count_tokens(lines) if lines else []
+    return {
+        id(event): (counts[2 * i], counts[2 * i + 1])
+        for i, event in enumerate(completions)
+    }
+
+
+def _aggregate(events, token_counts):
+    """
+    Agrupa por usuario, tipo y modelo: cada flush escribe un item por grupo
+    en lugar de uno por request. Los tokens estimados van en un grupo aparte
+    para no mezclarlos con los informados por el proveedor.
+    """
+    groups = {}
+    for event in events:
+        estimated = _is_estimated(event)
+        key = (event.user_id, event.kind, event.provider, event.model, estimated)
+        group = groups.setdefault(
+            key, {"requests": 0, "quantity": 0, "input": 0, "output": 0}
+        )
+        group["requests"] += 1
+        if event.kind == "completion":
+            if estimated:
+                input_tokens, output_tokens = token_counts[id(event)]
+            else:
+                input_tokens = event.input_tokens
+                output_tokens = event.output_tokens or 0
+            group["input"] += input_tokens
+            group["output"] += output_tokens
+        else:
+            group["quantity"] += event.quantity
+    return groups
+
+
+def _describe_and_price(kind, provider, model, group, estimated=False):
+    label = f"{provider}/{model}"
+    requests = group["requests"]
+    if kind == "completion":
+        input_price, output_price = price_for(COMPLETION_PRICES, model)
+        if provider in FREE_PROVIDERS:
+            input_price = output_price = 0.0
+        cost = (group["input"] * input_price + group["output"] * output_price) / 1e6
+        description = (
+            f"Completion {label}: {requests} requests, "
+            f"{group['input']} input + {group['output']} output tokens"
+        )
+        if estimated:
+            description += " (estimated)"
+        return description, cost
+    if kind == "transcription":
+        seconds = group["quantity"]
+        cost = seconds / 60 * price_for(TRANSCRIPTION_PRICES, model)
+        return f"Transcription {label}: {requests} files, {seconds:.1f} seconds", cost
+    if kind == "speech":
+        characters = int(group["quantity"])
+        cost = characters / 1e6 * price_for(SPEECH_PRICES, model)
+        return f"Speech {label}: {requests} requests, {characters} characters", cost
+    if kind == "image":
+        images = int(group["quantity"])
+        cost = images * price_for(IMAGE_PRICES, model)
+        return f"Image {label}: {images} images", cost
+    if kind == "embedding":
+        tokens = int(group["quantity"])
+        cost = tokens / 1e6 * price_for(EMBEDDING_PRICES, model)
+        return f"Embedding {label}: {requests} requests, {tokens} tokens", cost
+    raise ValueError(f"Unknown usage kind: {kind}")
+
+
+async def _organizations_for(user_ids):
+    """user_id -> (organization_id, billing_ratio) de su primera organizacion."""
+    rows = await database.fetch_all(
+        Organization.__table__.select()
+        .where(Organization.owner_id.in_(user_ids))
+        .order_by(Organization.id)
+    )
+    organizations = {}
+    for row in rows:
+        organizations.setdefault(
+            row["owner_id"], (row["id"], row["billing_ratio"] or 1.0)
+        )
+    return organizations
+
+
+async def _select_open_periods(organization_ids):
+    rows = await database.fetch_all(
+        ConsumptionPeriod.__table__.select()
+        .where(ConsumptionPeriod.organization_id.in_(organization_ids))
+        .where(ConsumptionPeriod.status == "OPEN")
+    )
+    return {row["organization_id"]: row["id"] for row in rows}
+
+
+async def _open_periods_for(organization_ids):
+    """organization_id -> id de su periodo OPEN; abre los que falten."""
+    periods = await _select_open_periods(organization_ids)
+    missing = set(organization_ids) - periods.keys()
+    if not missing:
+        return periods
+
+    # Otro worker puede abrir el mismo periodo entre el select y el insert: el
+    # indice unico parcial lo impide y el conflicto se ignora
+    insert = (sqlite if IS_SQLITE else postgresql).insert(ConsumptionPeriod.__table__)
+    await database.execute_many(
+        insert.on_conflict_do_nothing(
+            index_elements=["organization_id"],
+            index_where=ConsumptionPeriod.status == "OPEN",
+        ),
+        values=[
+            {
+                "organization_id": organization_id,
+                "started_at": datetime.utcnow(),
+                "status": "OPEN",
+            }
+            for organization_id in missing
+        ],
+    )
+    periods.update(await _select_open_periods(missing))
+    return periods
+
+
+async def flush_usage():
+    """Escribe los eventos pendientes como ConsumptionItem en una transaccion."""
+    async with _flush_lock:
+        if not _events:
+            return
+        events = _events[:]
+        del _events[: len(events)]
+
+        try:
+            token_counts = await asyncio.to_thread(_count_completion_tokens, events)
+            groups = _aggregate(events, token_counts)
+
+            async with database.transaction():
+                user_ids = {key[0] for key in groups}
+                organizations = await _organizations_for(user_ids)
+                periods = await _open_periods_for(
+                    {organization_id for organization_id, _ in organizations.values()}
+                )
+
+                items = []
+                for key, group in groups.items():
+                    user_id, kind, provider, model, estimated = key
+                    if user_id not in organizations:
+                        # Sin organizacion no hay a quien facturar
+                        continue
+                    organization_id, billing_ratio = organizations[user_id]
+                    description, cost = _describe_and_price(
+                        kind, provider, model, group, estimated
+                    )
+                    items.append(
+                        {
+                            "consumption_period_id": periods[organization_id],
+                            "description": description,
+                            "amount": cost * billing_ratio,
+                        }
+                    )
+
+                if items:
+                    await database.execute_many(
+                        ConsumptionItem.__table__.insert(), values=items
+                    )
+        except asyncio.CancelledError:
+            _events[:0] = events
+            raise
+        except Exception as e:
+            # Se devuelven al buffer para el proximo intento
+            logger.error(f"Could not flush {len(events)} usage events: {e}")
+            _events[:0] = events
+
+
+async def metered_stream(user_id, provider: str, model: str, prompt: str, stream):
+    """
+    Registra el consumo de una completion al terminar el stream del proveedor,
+    tambien si se corta antes (el proveedor cobra lo generado). Se usan los
+    tokens que informa el proveedor (CompletionUsage); si no llegan, por
+    ejemplo porque el stream se corto, se estiman a partir del texto.
+    """
+    parts = []
+    reported = None
+    try:
+        async for chunk in stream:
+            if isinstance(chunk, CompletionUsage):
+                reported = chunk
+                continue
+            parts.append(chunk)
+            yield chunk
+    finally:
+        if reported is not None:
+            record_usage(
+                user_id,
+                "completion",
+                provider,
+                model,
+                input_tokens=reported.input_tokens,
+                output_tokens=reported.output_tokens,
+            )
+        elif parts:
+            record_usage(
+                user_id,
+                "completion",
+                provider,
+                model,
+                prompt=prompt,
+                completion="".join(parts),
+            )
+
+
+async def _flush_loop():
+    while True:
+        try:
+            await asyncio.wait_for(_flush_requested.wait(), USAGE_FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _flush_requested.clear()
+        await flush_usage()
+
+
+def start_usage_flusher():
+    global _flusher, _flush_requested
+    _flush_requested = asyncio.Event()
+    _flusher = asyncio.create_task(_flush_loop())
+
+
+async def stop_usage_flusher():
+    global _flusher, _flush_requested
+    if _flusher is not None:
+        _flusher.cancel()
+        try:
+            await _flusher
+        except asyncio.CancelledError:
+            pass
+        _flusher = None
+    _flush_requested = None
+    # Lo que quedo en memoria se escribe antes de cerrar la base
+    await flush_usage()
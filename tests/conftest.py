@@ -0,0 +1,74 @@
+import os
+import tempfile
+import uuid
+
+# La configuracion se lee al importar los modulos de la app: todo esto va
+# antes del primer import de main/database
+_workdir = tempfile.mkdtemp(prefix="media-tests-")
+os.environ.update(
+    {
+        "DATABASE_URL": f"sqlite:///{os.path.join(_workdir, 'test.db')}",
+        "OPENAI_API_KEY": "test",
+        # Nada de red: los catalogos de modelos fallan rapido
+        "OPENAI_BASE_URL": "http://127.0.0.1:9/v1",
+        "OLLAMA_BASE_URL": "http://127.0.0.1:9",
+        "COMPLETION_CACHE_TTL": "0",
+        "LOG_LEVEL": "WARNING",
+        "LOG_FILE": os.path.join(_workdir, "app.log"),
+    }
+)
+
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture(scope="session")
+def client():
+    # main monta client/dist/assets y crea audios/ relativos al directorio
+    # actual
+    os.makedirs(os.path.join(_workdir, "client", "dist", "assets"))
+    cwd = os.getcwd()
+    os.chdir(_workdir)
+    try:
+        from main import app
+
+        with TestClient(app) as client:
+            yield client
+    finally:
+        os.chdir(cwd)
+
+
+@pytest.fixture
+def run(client):
+    """Corre una corrutina en el event loop de la app (el de la base)."""
+
+    def run(function, *args, **kwargs):
+        return client.portal.call(lambda: function(*args, **kwargs))
+
+    return run
+
+
+@pytest.fixture
+def login(client):
+    """Crea un usuario nuevo y devuelve (user_id, token)."""
+
+    def login():
+        email = f"{uuid.uuid4().hex}@example.com"
+        client.post(
+            "/signup/",
+            json={"username": email, "email": email, "password": "secret"},
+        ).raise_for_status()
+        response = client.post(
+            "/login/", json={"email": email, "password": "secret"}
+        )
+        response.raise_for_status()
+        token = response.json()["token"]
+
+        from database import database, User
+
+        user = client.portal.call(
+            database.fetch_one, User.__table__.select().where(User.email == email)
+        )
+        return user["id"], token
+
+    return login
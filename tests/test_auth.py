@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta
+
+from database import database, Token
+from server.utils import token_cache
+
+
+def headers(token):
+    return {"Authorization": f"Token {token}"}
+
+
+def test_login_token_authorizes_requests(client, login):
+    _, token = login()
+
+    response = client.get("/conversations", headers=headers(token))
+
+    assert response.status_code == 200
+    assert response.json() == []
+
+
+def test_unknown_token_is_rejected(client):
+    response = client.get("/conversations", headers=headers("not-a-token"))
+
+    assert response.status_code == 401
+    assert response.json()["detail"] == "Invalid token"
+
+
+def test_expired_token_is_rejected(client, login, run):
+    _, token = login()
+    run(
+        database.execute,
+        Token.__table__.update()
+        .where(Token.token == token)
+        .values(expiration_date=datetime.utcnow() - timedelta(minutes=1)),
+    )
+
+    response = client.get("/conversations", headers=headers(token))
+
+    assert response.status_code == 401
+    assert response.json()["detail"] == "Token expired"
+    assert token_cache.get(token) == (False, None)
+
+
+def test_cached_token_expires_without_hitting_the_database(client, login):
+    _, token = login()
+    assert client.get("/conversations", headers=headers(token)).status_code == 200
+
+    # Vence mientras esta en el cache: la expiracion cacheada se respeta
+    cached, valid_until = token_cache._cache[token]
+    token_cache._cache[token] = (
+        cached._replace(expiration_date=datetime.utcnow() - timedelta(seconds=1)),
+        valid_until,
+    )
+
+    response = client.get("/conversations", headers=headers(token))
+
+    assert response.status_code == 401
+    assert response.json()["detail"] == "Token expired"
+
+
+def test_logout_revokes_a_cached_token(client, login):
+    _, token = login()
+    assert client.get("/conversations", headers=headers(token)).status_code == 200
+
+    response = client.post("/logout/", headers=headers(token))
+    assert response.status_code == 200
+
+    response = client.get("/conversations", headers=headers(token))
+    assert response.status_code == 401
+    assert response.json()["detail"] == "Invalid token"
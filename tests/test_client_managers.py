@@ -0,0 +1,90 @@
+import asyncio
+import uuid
+
+import socketio
+
+from server.client_managers import (
+    InMemoryPubSubManager,
+    on_worker_message,
+    publish_worker_message,
+)
+
+
+def start_servers(count):
+    # Cada server hace de un worker; comparten un canal propio del test
+    channel = f"test-{uuid.uuid4().hex}"
+    servers = []
+    for _ in range(count):
+        server = socketio.AsyncServer(
+            async_mode="asgi",
+            client_manager=InMemoryPubSubManager(channel=channel),
+        )
+        server.manager_initialized = True
+        server.manager.initialize()
+        servers.append(server)
+    return servers
+
+
+def record_packets(server):
+    sent = []
+
+    async def send_eio_packet(eio_sid, eio_packet):
+        sent.append((eio_sid, eio_packet.data))
+
+    server._send_eio_packet = send_eio_packet
+    return sent
+
+
+def test_emit_reaches_a_client_connected_to_another_server():
+    async def scenario():
+        first, second = start_servers(2)
+        sent = record_packets(second)
+        sid = await second.manager.connect("eio-1", "/")
+
+        await first.emit("response", {"chunk": "hola"}, to=sid)
+        await asyncio.sleep(0.05)
+        return sent
+
+    sent = asyncio.run(scenario())
+    assert len(sent) == 1
+    eio_sid, data = sent[0]
+    assert eio_sid == "eio-1"
+    assert '"response"' in data and '"hola"' in data
+
+
+def test_emit_to_a_local_client_skips_the_queue():
+    async def scenario():
+        first, second = start_servers(2)
+        local = record_packets(first)
+        remote = record_packets(second)
+        sid = await first.manager.connect("eio-1", "/")
+
+        published = []
+        publish = first.manager._publish
+
+        async def spy(data):
+            published.append(data)
+            await publish(data)
+
+        first.manager._publish = spy
+        await first.emit("response", {"chunk": "hola"}, to=sid)
+        await asyncio.sleep(0.05)
+        return local, remote, published
+
+    local, remote, published = asyncio.run(scenario())
+    assert len(local) == 1
+    assert remote == []
+    assert published == []
+
+
+def test_worker_messages_run_once_on_every_server():
+    calls = []
+    on_worker_message("test_invalidate", lambda key: calls.append(key))
+
+    async def scenario():
+        first, _second, _third = start_servers(3)
+        await publish_worker_message(first.manager, "test_invalidate", key="abc")
+        await asyncio.sleep(0.05)
+
+    asyncio.run(scenario())
+    assert calls == ["abc", "abc", "abc"]
@@ -0,0 +1,141 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from server.utils import completion_cache as cache
+from server.utils import usage
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch):
+    monkeypatch.setattr(cache, "COMPLETION_CACHE_TTL", 60)
+    monkeypatch.setattr(cache, "_cache", type(cache._cache)())
+    monkeypatch.setattr(cache, "_embeddings", {})
+    monkeypatch.setattr(cache, "_embedding_buckets", {})
+    monkeypatch.setattr(usage, "_events", [])
+
+
+def upstream(chunks, calls):
+    async def stream():
+        calls.append(1)
+        for chunk in chunks:
+            yield chunk
+
+    return stream
+
+
+async def collect(stream):
+    return [chunk async for chunk in stream]
+
+
+def test_key_ignores_whitespace_and_message_case():
+    key = cache.completion_cache_key("openai", "gpt-4o-mini", "Sos  util.", "Hola   Mundo ")
+
+    assert key == cache.completion_cache_key(
+        "openai", "gpt-4o-mini", "Sos util.", "hola mundo"
+    )
+    assert key != cache.completion_cache_key(
+        "ollama", "gpt-4o-mini", "Sos util.", "hola mundo"
+    )
+    assert key != cache.completion_cache_key(
+        "openai", "gpt-4o-mini", "Otro prompt", "hola mundo"
+    )
+
+
+def test_expired_entries_are_dropped():
+    cache.put("key", "respuesta")
+    assert cache.get("key") == "respuesta"
+
+    response, _ = cache._cache["key"]
+    cache._cache["key"] = (response, 0.0)
+
+    assert cache.get("key") is None
+    assert "key" not in cache._cache
+
+
+def test_least_recently_used_entry_is_evicted(monkeypatch):
+    monkeypatch.setattr(cache, "COMPLETION_CACHE_MAX_ENTRIES", 2)
+    cache.put("a", "1")
+    cache.put("b", "2")
+    cache.get("a")
+    cache.put("c", "3")
+
+    assert list(cache._cache) == ["a", "c"]
+
+
+def test_replay_splits_the_response_in_small_chunks():
+    response = "x" * (cache.REPLAY_CHUNK_CHARS * 2 + 5)
+
+    chunks = asyncio.run(collect(cache.replay(response)))
+
+    assert "".join(chunks) == response
+    assert [len(chunk) for chunk in chunks] == [
+        cache.REPLAY_CHUNK_CHARS,
+        cache.REPLAY_CHUNK_CHARS,
+        5,
+    ]
+
+
+def test_complete_stream_is_cached_and_replayed():
+    calls = []
+    args = ("openai", "gpt-4o-mini", "prompt", "hola")
+
+    first = asyncio.run(
+        collect(cache.cached_stream(*args, upstream(["ho", "la"], calls)))
+    )
+    second = asyncio.run(
+        collect(cache.cached_stream(*args, upstream(["otra"], calls)))
+    )
+
+    assert first == ["ho", "la"]
+    assert "".join(second) == "hola"
+    assert len(calls) == 1
+
+
+def test_cancelled_stream_is_not_cached():
+    calls = []
+    args = ("openai", "gpt-4o-mini", "prompt", "hola")
+
+    async def consume_first_chunk():
+        stream = cache.cached_stream(*args, upstream(["ho", "la"], calls))
+        chunk = await stream.__anext__()
+        await stream.aclose()
+        return chunk
+
+    assert asyncio.run(consume_first_chunk()) == "ho"
+    assert cache._cache == {}
+
+    asyncio.run(collect(cache.cached_stream(*args, upstream(["ho", "la"], calls))))
+    assert len(calls) == 2
+
+
+def test_semantic_embedding_uses_the_user_client_and_is_billed(monkeypatch):
+    requested = []
+
+    async def create(model, input):
+        return SimpleNamespace(
+            data=[SimpleNamespace(embedding=[1.0, 0.0])],
+            usage=SimpleNamespace(prompt_tokens=7),
+        )
+
+    async def openai_client_for(user_id):
+        requested.append(user_id)
+        return SimpleNamespace(embeddings=SimpleNamespace(create=create))
+
+    monkeypatch.setattr(cache, "COMPLETION_CACHE_SEMANTIC", True)
+    monkeypatch.setattr(cache, "openai_client_for", openai_client_for)
+
+    calls = []
+    asyncio.run(
+        collect(
+            cache.cached_stream(
+                "openai", "gpt-4o-mini", "prompt", "hola", upstream(["r"], calls), 42
+            )
+        )
+    )
+
+    assert requested == [42]
+    assert [(e.user_id, e.kind, e.quantity) for e in usage._events] == [
+        (42, "embedding", 7)
+    ]
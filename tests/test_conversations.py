@@ -0,0 +1,114 @@
+from database import database, Conversation
+from server.utils.conversations import insert_message
+
+
+def headers(token):
+    return {"Authorization": f"Token {token}"}
+
+
+def create_conversation(run, user_id, messages=()):
+    conversation_id = run(
+        database.execute,
+        Conversation.__table__.insert().values(user_id=user_id, message_count=0),
+    )
+    for i, text in enumerate(messages):
+        run(insert_message, conversation_id, "user" if i % 2 == 0 else "assistant", text)
+    return conversation_id
+
+
+def test_insert_message_updates_counters(login, run):
+    user_id, _ = login()
+    conversation_id = create_conversation(run, user_id)
+
+    for text in ["uno", "dos", "tres"]:
+        run(insert_message, conversation_id, "user", text)
+
+    row = run(
+        database.fetch_one,
+        Conversation.__table__.select().where(Conversation.id == conversation_id),
+    )
+    assert row["message_count"] == 3
+    assert row["last_message_at"] is not None
+
+
+def test_conversations_are_paginated_with_a_cursor(client, login, run):
+    user_id, token = login()
+    created = [
+        create_conversation(run, user_id, messages=["hola"] * (i + 1))
+        for i in range(5)
+    ]
+
+    pages = []
+    params = {"limit": 2}
+    while True:
+        response = client.get("/conversations", params=params, headers=headers(token))
+        assert response.status_code == 200
+        pages.append(response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+        params = {"limit": 2, "before": cursor}
+
+    assert [len(page) for page in pages] == [2, 2, 1]
+    listed = [conversation for page in pages for conversation in page]
+    assert [conversation["id"] for conversation in listed] == created[::-1]
+    assert [conversation["message_count"] for conversation in listed] == [
+        5,
+        4,
+        3,
+        2,
+        1,
+    ]
+
+
+def test_conversation_messages_are_paginated_with_a_cursor(client, login, run):
+    user_id, token = login()
+    texts = [f"mensaje {i}" for i in range(5)]
+    conversation_id = create_conversation(run, user_id, messages=texts)
+
+    pages = []
+    params = {"limit": 2}
+    while True:
+        response = client.get(
+            f"/conversation/{conversation_id}", params=params, headers=headers(token)
+        )
+        assert response.status_code == 200
+        body = response.json()
+        pages.append([message["text"] for message in body["messages"]])
+        if body["next_cursor"] is None:
+            break
+        params = {"limit": 2, "before": body["next_cursor"]}
+
+    # Cada pagina en orden cronologico, de la mas nueva a la mas vieja
+    assert pages == [texts[3:5], texts[1:3], texts[0:1]]
+
+
+def test_conversation_of_another_user_is_not_found(client, login, run):
+    owner_id, _ = login()
+    _, other_token = login()
+    conversation_id = create_conversation(run, owner_id, messages=["privado"])
+
+    response = client.get(
+        f"/conversation/{conversation_id}", headers=headers(other_token)
+    )
+
+    assert response.status_code == 404
+
+
+def test_completion_with_unknown_provider_is_rejected_before_saving(
+    client, login, run
+):
+    user_id, token = login()
+
+    response = client.post(
+        "/get_completion/",
+        json={"message": "hola", "model": {"name": "x", "provider": "bogus"}},
+        headers=headers(token),
+    )
+
+    assert response.status_code == 400
+    rows = run(
+        database.fetch_all,
+        Conversation.__table__.select().where(Conversation.user_id == user_id),
+    )
+    assert rows == []
@@ -0,0 +1,59 @@
+import asyncio
+
+from server.utils.emitter import CoalescingEmitter
+
+
+def emitter_with_log(**kwargs):
+    emitted = []
+
+    async def emit(chunk):
+        emitted.append(chunk)
+
+    return CoalescingEmitter(emit, **kwargs), emitted
+
+
+def test_first_chunk_is_sent_immediately_and_the_rest_batched():
+    async def scenario():
+        emitter, emitted = emitter_with_log(flush_interval_ms=20, flush_bytes=1024)
+        for chunk in ["Hola", " que", " tal", "?"]:
+            await emitter.push(chunk)
+        assert emitted == ["Hola"]
+
+        await asyncio.sleep(0.05)
+        assert emitted == ["Hola", " que tal?"]
+        await emitter.close()
+        return emitter, emitted
+
+    emitter, emitted = asyncio.run(scenario())
+    assert emitted == ["Hola", " que tal?"]
+    assert emitter.text == "Hola que tal?"
+
+
+def test_buffer_is_flushed_when_it_reaches_flush_bytes():
+    async def scenario():
+        emitter, emitted = emitter_with_log(
+            flush_interval_ms=10_000, flush_bytes=6, first_chunk_immediate=False
+        )
+        for chunk in ["abc", "def", "gh"]:
+            await emitter.push(chunk)
+        assert emitted == ["abcdef"]
+
+        await emitter.close()
+        return emitted
+
+    assert asyncio.run(scenario()) == ["abcdef", "gh"]
+
+
+def test_cancel_drops_pending_chunks():
+    async def scenario():
+        emitter, emitted = emitter_with_log(flush_interval_ms=10)
+        await emitter.push("primero")
+        await emitter.push(" pendiente")
+        emitter.cancel()
+        await asyncio.sleep(0.03)
+        return emitter, emitted
+
+    emitter, emitted = asyncio.run(scenario())
+    assert emitted == ["primero"]
+    # Lo generado se conserva para guardarlo aunque no se haya emitido
+    assert emitter.text == "primero pendiente"
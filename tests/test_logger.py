@@ -0,0 +1,10 @@
+from server.logger import log_file_for_process
+
+
+def test_single_worker_keeps_the_configured_file():
+    assert log_file_for_process("logs/app.log", 1, 123) == "logs/app.log"
+
+
+def test_each_worker_gets_its_own_file():
+    assert log_file_for_process("logs/app.log", 4, 123) == "logs/app.123.log"
+    assert log_file_for_process("app", 4, 123) == "app.123"
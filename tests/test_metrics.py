@@ -0,0 +1,21 @@
+from server.utils import metrics
+
+
+def test_metrics_are_disabled_without_a_token(client, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_TOKEN", "")
+
+    assert client.get("/metrics").status_code == 404
+
+
+def test_metrics_require_the_bearer_token(client, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_TOKEN", "secreto")
+
+    assert client.get("/metrics").status_code == 401
+    assert (
+        client.get("/metrics", headers={"Authorization": "Bearer otro"}).status_code
+        == 401
+    )
+
+    response = client.get("/metrics", headers={"Authorization": "Bearer secreto"})
+    assert response.status_code == 200
+    assert "completion_time_to_first_token_seconds" in response.text
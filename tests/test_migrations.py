@@ -0,0 +1,152 @@
+import asyncio
+import sqlite3
+
+from databases import Database
+
+import database as database_module
+
+# Esquema de antes de content_hash y de los contadores de conversaciones
+OLD_SCHEMA = """
+CREATE TABLE users (
+    id INTEGER NOT NULL PRIMARY KEY,
+    username VARCHAR NOT NULL UNIQUE,
+    email VARCHAR NOT NULL UNIQUE,
+    password VARCHAR NOT NULL
+);
+CREATE TABLE conversations (
+    id INTEGER NOT NULL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users (id)
+);
+CREATE TABLE messages (
+    id INTEGER NOT NULL PRIMARY KEY,
+    conversation_id INTEGER NOT NULL REFERENCES conversations (id),
+    sender VARCHAR NOT NULL,
+    text TEXT NOT NULL,
+    timestamp DATETIME
+);
+CREATE TABLE audios (
+    id INTEGER NOT NULL PRIMARY KEY,
+    filename VARCHAR NOT NULL,
+    transcription TEXT NOT NULL
+);
+INSERT INTO users (id, username, email, password) VALUES (1, 'u', 'u@x', 'p');
+INSERT INTO conversations (id, user_id) VALUES (1, 1), (2, 1);
+INSERT INTO messages (conversation_id, sender, text, timestamp) VALUES
+    (1, 'user', 'hola', '2024-01-01 10:00:00'),
+    (1, 'assistant', 'que tal', '2024-01-01 10:00:05');
+INSERT INTO audios (filename, transcription) VALUES ('a.mp3', 'texto');
+"""
+
+
+def test_migrate_schema_upgrades_an_existing_database(tmp_path, monkeypatch):
+    path = tmp_path / "old.db"
+    connection = sqlite3.connect(path)
+    connection.executescript(OLD_SCHEMA)
+    connection.close()
+
+    old_database = Database(f"sqlite:///{path}")
+    monkeypatch.setattr(database_module, "database", old_database)
+
+    async def scenario():
+        await old_database.connect()
+        try:
+            # Dos veces: la segunda no tiene que hacer nada
+            await database_module.migrate_schema()
+            await database_module.migrate_schema()
+            return await old_database.fetch_all(
+                "SELECT id, message_count, last_message_at FROM conversations "
+                "ORDER BY id"
+            )
+        finally:
+            await old_database.disconnect()
+
+    rows = asyncio.run(scenario())
+
+    assert [(row[0], row[1]) for row in rows] == [(1, 2), (2, 0)]
+    assert str(rows[0][2]).startswith("2024-01-01 10:00:05")
+    assert rows[1][2] is None
+
+    connection = sqlite3.connect(path)
+    audio_columns = {row[1] for row in connection.execute("PRAGMA table_info(audios)")}
+    indexes = {row[1] for row in connection.execute("PRAGMA index_list(audios)")}
+    tables = {
+        row[0]
+        for row in connection.execute("SELECT name FROM sqlite_master WHERE type='table'")
+    }
+    connection.close()
+    assert "content_hash" in audio_columns
+    assert "ix_audios_content_hash" in indexes
+    assert {"tokens", "organizations", "consumption_items"} <= tables
+
+
+DUPLICATE_PERIODS = """
+CREATE TABLE users (
+    id INTEGER NOT NULL PRIMARY KEY,
+    username VARCHAR NOT NULL UNIQUE,
+    email VARCHAR NOT NULL UNIQUE,
+    password VARCHAR NOT NULL
+);
+CREATE TABLE organizations (
+    id INTEGER NOT NULL PRIMARY KEY,
+    name VARCHAR NOT NULL,
+    owner_id INTEGER NOT NULL REFERENCES users (id),
+    billing_ratio FLOAT
+);
+CREATE TABLE consumption_periods (
+    id INTEGER NOT NULL PRIMARY KEY,
+    organization_id INTEGER NOT NULL REFERENCES organizations (id),
+    started_at DATETIME NOT NULL,
+    ended_at DATETIME,
+    status VARCHAR NOT NULL
+);
+CREATE TABLE consumption_items (
+    id INTEGER NOT NULL PRIMARY KEY,
+    consumption_period_id INTEGER NOT NULL REFERENCES consumption_periods (id),
+    description TEXT NOT NULL,
+    amount FLOAT NOT NULL
+);
+INSERT INTO users (id, username, email, password) VALUES (1, 'u', 'u@x', 'p');
+INSERT INTO organizations (id, name, owner_id) VALUES (1, 'org', 1);
+INSERT INTO consumption_periods (id, organization_id, started_at, status) VALUES
+    (1, 1, '2024-01-01', 'BILLED'),
+    (2, 1, '2024-02-01', 'OPEN'),
+    (3, 1, '2024-02-01', 'OPEN');
+INSERT INTO consumption_items (consumption_period_id, description, amount) VALUES
+    (1, 'enero', 1.0),
+    (2, 'a', 2.0),
+    (3, 'b', 3.0);
+"""
+
+
+def test_migrate_schema_merges_duplicate_open_periods(tmp_path, monkeypatch):
+    path = tmp_path / "old.db"
+    connection = sqlite3.connect(path)
+    connection.executescript(DUPLICATE_PERIODS)
+    connection.close()
+
+    old_database = Database(f"sqlite:///{path}")
+    monkeypatch.setattr(database_module, "database", old_database)
+
+    async def scenario():
+        await old_database.connect()
+        try:
+            await database_module.migrate_schema()
+        finally:
+            await old_database.disconnect()
+
+    asyncio.run(scenario())
+
+    connection = sqlite3.connect(path)
+    periods = connection.execute(
+        "SELECT id, status FROM consumption_periods ORDER BY id"
+    ).fetchall()
+    items = connection.execute(
+        "SELECT consumption_period_id, description FROM consumption_items ORDER BY id"
+    ).fetchall()
+    indexes = {
+        row[1] for row in connection.execute("PRAGMA index_list(consumption_periods)")
+    }
+    connection.close()
+    assert periods == [(1, "BILLED"), (2, "OPEN")]
+    assert items == [(1, "enero"), (2, "a"), (2, "b")]
+    assert "ux_consumption_periods_open_organization" in indexes
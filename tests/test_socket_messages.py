@@ -0,0 +1,84 @@
+import pytest
+
+from database import database, Message
+from server import event_triggers
+from server.socket import sio
+
+
+@pytest.fixture
+def emitted(monkeypatch):
+    events = []
+
+    async def emit(event, data=None, to=None, **kwargs):
+        events.append((event, data))
+
+    monkeypatch.setattr(sio, "emit", emit)
+    return events
+
+
+@pytest.fixture
+def prompts(monkeypatch):
+    seen = []
+
+    async def fake_completion(provider, model, system_prompt, message, user_id=None):
+        seen.append(system_prompt)
+        yield f"eco: {message}"
+
+    monkeypatch.setattr(event_triggers, "create_streaming_completion", fake_completion)
+    return seen
+
+
+def finished(events):
+    return [data for event, data in events if event == "responseFinished"]
+
+
+def test_first_message_creates_a_conversation_used_by_the_next(
+    login, run, emitted, prompts
+):
+    user_id, token = login()
+    model = {"provider": "openai", "name": "gpt-4o-mini"}
+
+    run(
+        event_triggers.on_message_handler,
+        "sid",
+        {"message": "hola", "model": model, "token": token},
+    )
+    first = finished(emitted)[-1]
+    assert first["status"] == "ok"
+    conversation_id = first["conversation_id"]
+    assert conversation_id is not None
+
+    run(
+        event_triggers.on_message_handler,
+        "sid",
+        {
+            "message": "sigo",
+            "model": model,
+            "token": token,
+            "conversation_id": conversation_id,
+        },
+    )
+    assert finished(emitted)[-1]["conversation_id"] == conversation_id
+
+    # El segundo turno arma el contexto en el servidor con lo guardado
+    assert "hola" in prompts[1] and "eco: hola" in prompts[1]
+    rows = run(
+        database.fetch_all,
+        Message.__table__.select()
+        .where(Message.conversation_id == conversation_id)
+        .order_by(Message.id),
+    )
+    assert [row["text"] for row in rows] == ["hola", "eco: hola", "sigo", "eco: sigo"]
+
+
+def test_unknown_provider_is_rejected_on_the_socket(run, emitted, prompts):
+    run(
+        event_triggers.on_message_handler,
+        "sid",
+        {"message": "hola", "model": {"provider": "bogus", "name": "x"}},
+    )
+
+    assert finished(emitted) == [
+        {"status": "error", "detail": "Unknown completion provider: bogus"}
+    ]
+    assert prompts == []
@@ -0,0 +1,182 @@
+import asyncio
+
+import pytest
+
+from database import database, Organization, ConsumptionPeriod, ConsumptionItem
+from server.utils import usage
+from server.utils.usage import UsageEvent
+
+
+def event(kind="completion", model="gpt-4o-mini", quantity=0, **tokens):
+    return UsageEvent(
+        1,
+        kind,
+        "openai",
+        model,
+        quantity,
+        tokens.get("prompt"),
+        tokens.get("completion"),
+        tokens.get("input_tokens"),
+        tokens.get("output_tokens"),
+    )
+
+
+@pytest.fixture
+def events(monkeypatch):
+    pending = []
+    monkeypatch.setattr(usage, "_events", pending)
+    return pending
+
+
+def test_price_for_uses_the_longest_matching_prefix():
+    prices = usage.COMPLETION_PRICES
+
+    assert usage.price_for(prices, "gpt-4o-mini-2024-07-18") == prices["gpt-4o-mini"]
+    assert usage.price_for(prices, "gpt-4o-2024-08-06") == prices["gpt-4o"]
+    assert usage.price_for(prices, "modelo-nuevo") == prices["default"]
+    assert usage.price_for(prices, None) == prices["default"]
+
+
+def test_aggregate_keeps_reported_and_estimated_tokens_apart():
+    reported = [
+        event(input_tokens=10, output_tokens=5),
+        event(input_tokens=20, output_tokens=None),
+    ]
+    estimated = event(prompt="hola", completion="que tal")
+
+    groups = usage._aggregate(
+        [*reported, estimated, event("speech", "tts-1", 40)],
+        {id(estimated): (3, 4)},
+    )
+
+    assert groups == {
+        (1, "completion", "openai", "gpt-4o-mini", False): {
+            "requests": 2, "quantity": 0, "input": 30, "output": 5
+        },
+        (1, "completion", "openai", "gpt-4o-mini", True): {
+            "requests": 1, "quantity": 0, "input": 3, "output": 4
+        },
+        (1, "speech", "openai", "tts-1", False): {
+            "requests": 1, "quantity": 40, "input": 0, "output": 0
+        },
+    }
+
+
+def test_describe_and_price():
+    group = {"requests": 2, "quantity": 0, "input": 1_000_000, "output": 500_000}
+
+    description, cost = usage._describe_and_price(
+        "completion", "openai", "gpt-4o-mini", group
+    )
+    assert description == (
+        "Completion openai/gpt-4o-mini: 2 requests, "
+        "1000000 input + 500000 output tokens"
+    )
+    assert cost == pytest.approx(0.15 + 0.30)
+
+    description, _ = usage._describe_and_price(
+        "completion", "openai", "gpt-4o-mini", group, estimated=True
+    )
+    assert description.endswith("(estimated)")
+
+    _, cost = usage._describe_and_price("completion", "ollama", "llama3", group)
+    assert cost == 0
+
+    transcription = {"requests": 1, "quantity": 90, "input": 0, "output": 0}
+    description, cost = usage._describe_and_price(
+        "transcription", "openai", "whisper-1", transcription
+    )
+    assert description == "Transcription openai/whisper-1: 1 files, 90.0 seconds"
+    assert cost == pytest.approx(0.009)
+
+    with pytest.raises(ValueError):
+        usage._describe_and_price("video", "openai", "x", transcription)
+
+
+def create_organization(run, user_id, billing_ratio):
+    return run(
+        database.execute,
+        Organization.__table__.insert().values(
+            name="org", owner_id=user_id, billing_ratio=billing_ratio
+        ),
+    )
+
+
+def items_of(run, organization_id):
+    return run(
+        database.fetch_all,
+        ConsumptionItem.__table__.select()
+        .join(ConsumptionPeriod.__table__)
+        .where(ConsumptionPeriod.organization_id == organization_id)
+        .order_by(ConsumptionItem.id),
+    )
+
+
+def test_flush_usage_writes_billed_items(login, run, events):
+    user_id, _ = login()
+    organization_id = create_organization(run, user_id, 1.5)
+
+    for _ in range(2):
+        usage.record_usage(
+            user_id,
+            "completion",
+            "openai",
+            "gpt-4o-mini",
+            input_tokens=1_000_000,
+            output_tokens=0,
+        )
+    usage.record_usage(user_id, "speech", "openai", "tts-1", 1_000_000)
+    run(usage.flush_usage)
+
+    rows = items_of(run, organization_id)
+    assert events == []
+    assert [row["description"] for row in rows] == [
+        "Completion openai/gpt-4o-mini: 2 requests, 2000000 input + 0 output tokens",
+        "Speech openai/tts-1: 1 requests, 1000000 characters",
+    ]
+    assert [row["amount"] for row in rows] == pytest.approx([0.3 * 1.5, 15.0 * 1.5])
+    assert len({row["consumption_period_id"] for row in rows}) == 1
+
+
+def test_failed_flush_requeues_the_events(login, run, events, monkeypatch):
+    user_id, _ = login()
+    organization_id = create_organization(run, user_id, 1.0)
+    usage.record_usage(user_id, "image", "openai", "dall-e-3", 1)
+
+    async def database_down(user_ids):
+        raise ConnectionError("database down")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(usage, "_organizations_for", database_down)
+        run(usage.flush_usage)
+
+    assert [e.kind for e in events] == ["image"]
+    assert items_of(run, organization_id) == []
+
+    run(usage.flush_usage)
+    assert events == []
+    assert [row["description"] for row in items_of(run, organization_id)] == [
+        "Image openai/dall-e-3: 1 images"
+    ]
+
+
+def test_concurrent_flushes_open_a_single_period(login, run):
+    user_id, _ = login()
+    organization_id = create_organization(run, user_id, 1.0)
+
+    async def open_twice():
+        return await asyncio.gather(
+            usage._open_periods_for({organization_id}),
+            usage._open_periods_for({organization_id}),
+        )
+
+    first, second = run(open_twice)
+
+    assert first == second
+    rows = run(
+        database.fetch_all,
+        ConsumptionPeriod.__table__.select().where(
+            ConsumptionPeriod.organization_id == organization_id
+        ),
+    )
+    assert [row["status"] for row in rows] == ["OPEN"]
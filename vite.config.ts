@@ -1,9 +1,70 @@
-import { defineConfig } from 'vite'
+import { defineConfig, Plugin } from 'vite'
 import react from '@vitejs/plugin-react-swc'
+import { readdirSync, readFileSync, statSync, writeFileSync } from 'fs'
+import { join } from 'path'
+import { brotliCompressSync, constants, gzipSync } from 'zlib'
+
+// Escribe .br y .gz junto a cada asset para que el servidor los sirva
+// ya comprimidos, sin comprimir en cada request
+const COMPRESSIBLE = /\.(js|css|html|svg|json|txt|map)$/
+
+function precompress(): Plugin {
+  let outDir = ''
+  return {
+    name: 'precompress',
+    apply: 'build',
+    configResolved(config) {
+      outDir = join(config.root, config.build.outDir)
+    },
+    closeBundle() {
+      const walk = (dir: string) => {
+        for (const name of readdirSync(dir)) {
+          const path = join(dir, name)
+          if (statSync(path).isDirectory()) {
+            walk(path)
+          } else if (COMPRESSIBLE.test(name)) {
+            const content = readFileSync(path)
+            writeFileSync(`${path}.gz`, gzipSync(content, { level: 9 }))
+            writeFileSync(
+              `${path}.br`,
+              brotliCompressSync(content, {
+                params: { [constants.BROTLI_PARAM_QUALITY]: 11 },
+              })
+            )
+          }
+        }
+      }
+      walk(outDir)
+    },
+  }
+}
+
+// Lista los archivos que salen del bundle con [hash] en el nombre; el
+// servidor solo marca como immutable lo que esta en esta lista (los
+// archivos de public/ se copian sin hash y no aparecen)
+export const HASHED_ASSETS_MANIFEST = 'hashed-assets.json'
+
+function hashedAssets(): Plugin {
+  return {
+    name: 'hashed-assets',
+    apply: 'build',
+    generateBundle(_options, bundle) {
+      const files = Object.keys(bundle)
+        .filter((fileName) => fileName.startsWith('assets/'))
+        .map((fileName) => fileName.slice('assets/'.length))
+        .sort()
+      this.emitFile({
+        type: 'asset',
+        fileName: HASHED_ASSETS_MANIFEST,
+        source: JSON.stringify(files),
+      })
+    },
+  }
+}
 
 // https://vitejs.dev/config/
 export default defineConfig({
-  plugins: [react()],
+  plugins: [react(), hashedAssets(), precompress()],
   root: './client',
   envDir: './',
   define: {
@@ -16,13 +77,15 @@ export default defineConfig({
     assetsDir: 'assets',
     rollupOptions: {
       output: {
-        entryFileNames: 'assets/bundle.js',
-        // chunkFileNames: 'bundle.js',
-        // assetFileNames: 'bundle.[ext]'
+        // Todo lo que sale del bundle lleva [hash]: se puede cachear como
+        // immutable (ver hashedAssets)
+        entryFileNames: 'assets/bundle-[hash].js',
+        chunkFileNames: 'assets/[name]-[hash].js',
+        assetFileNames: 'assets/[name]-[hash][extname]',
       }
     }
   },
   server: {
-    
+
   }
 })